@@ -1,14 +1,23 @@
-import json
+import asyncio
+import gzip
+import hashlib
 import os
-from typing import Any, Dict, List, TypedDict
-from src.download import download_file
-from src.ocr import extract_text
-from src.llm import extract_information
+import msgspec
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple, TypedDict
+from src.download import download_bytes, get_object_etag
+from src.ocr import extract_text_batch
+from src.llm import extract_information, extract_information_batch, prewarm_generative_model
 from src.processor import process_extracted_data
 from src.formatter import format_sqs_message
-from src.sqs_sender import send_to_queue
+from src.sqs_sender import send_batch_to_queue
 from src.utils.logger import setup_logger
 from src.utils.helper import convert_bounding_box_format
+from src.utils.cache import LRUCache
+from src.utils.clients import get_s3_client, get_sqs_client, get_vision_client
+from src.utils.batch_queue import AsyncBatchQueue
 from src.s3_uploader import upload_to_s3  # 追加
 
 logger = setup_logger()
@@ -27,12 +36,71 @@ class S3Info(TypedDict):
 class SQSRecord(TypedDict):
     body: str
 
-class ProcessResult(TypedDict):
+# 1画像分の処理結果 (画像ごとに作成されるため、辞書ではなく__slots__のデータクラスにする)
+# orjsonはデータクラスをそのままJSONオブジェクトに変換する
+@dataclass(slots=True)
+class ProcessResult:
     file: str
     status: str
     message_id: str | None = None
     error: str | None = None
 
+# SQSメッセージ本文のスキーマ。起動時にデコーダを1回だけ構築し、
+# JSONのパースと型検証・フィールド取り出しをC実装で1パスで行う (未知のフィールドは無視される)
+class _ImageInfo(msgspec.Struct):
+    s3_key: str | None = None
+    index: Any = 'N/A'
+
+class _MessageBody(msgspec.Struct):
+    clipping_request_id: Any = None
+    images: List[_ImageInfo] = []
+
+_MESSAGE_BODY_DECODER = msgspec.json.Decoder(_MessageBody)
+
+def _decode_message_body(raw_body: str | bytes | Dict[str, Any]) -> _MessageBody:
+    """
+    SQSメッセージ本文をデコードする。
+    EventBridgeやテストからの呼び出しで本文が既に辞書になっている場合は、JSONのパースを省略して型検証のみ行う。
+
+    Raises:
+        msgspec.DecodeError: JSONとして不正、またはスキーマに合わない場合
+    """
+    if isinstance(raw_body, dict):
+        return msgspec.convert(raw_body, _MessageBody)
+    return _MESSAGE_BODY_DECODER.decode(raw_body)
+
+def _result(file: str, status: str, message_id: str | None = None, error: str | None = None) -> ProcessResult:
+    """
+    1画像分の処理結果を作成する
+    """
+    return ProcessResult(file, status, message_id, error)
+
+# 同時に処理する画像数の上限 (S3/Vision/LLM/SQSへの同時リクエスト数を抑える)
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", "8"))
+# 同時に行うS3ダウンロード数の上限 (OCR待ちの画像も先行してダウンロードする)
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "8"))
+# スレッドプールのワーカー数 (OCR/LLM・後処理と並行するS3アップロード・ダウンロード・SQS送信が同時に待てる数)
+# asyncioのデフォルト (CPU数+4) ではLambdaの少ないvCPUで上記の同時実行数に届かないため明示する
+IO_THREAD_POOL_SIZE = OCR_CONCURRENCY * 2 + DOWNLOAD_CONCURRENCY + 1
+# OCR結果をキャッシュする件数 (0で無効)。再送・重複配信されたS3オブジェクトのダウンロードとOCRを省略する
+OCR_CACHE_SIZE = int(os.environ.get("OCR_CACHE_SIZE", "32"))
+# S3にアップロードするLLM処理結果の圧縮形式 ("gzip" で圧縮し、Content-Encodingを設定する。空の場合は圧縮しない)
+LLM_OUTPUT_COMPRESSION = os.environ.get("LLM_OUTPUT_COMPRESSION", "").lower()
+# LLMへの1回のリクエストにまとめる画像数の上限 (1の場合はまとめずに画像ごとにリクエストする)
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE", "1"))
+# LLMへのリクエストをまとめるために待つ最大時間 (ミリ秒)
+LLM_BATCH_MAX_WAIT_MS = int(os.environ.get("LLM_BATCH_MAX_WAIT_MS", "50"))
+
+# モジュール読み込み時 (Lambdaの初期化フェーズ) にクライアントとGeminiモデルを作成しておくか
+# Lambda上ではデフォルトで有効 (ローカル実行やテストでは無効)
+PREWARM_CLIENTS = os.environ.get(
+    "PREWARM_CLIENTS", "true" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "false"
+).lower() == "true"
+
+# (バケット名, オブジェクトキー, ETag) およびファイル内容のハッシュをキーとしたOCR結果のキャッシュ (ウォームスタート間で共有)
+_ocr_cache = LRUCache(OCR_CACHE_SIZE)
+_CACHE_MISS = object()
+
 def process_document(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     SQSから受け取ったS3イベント情報をもとに処理を行うメインハンドラー
@@ -41,9 +109,15 @@ def process_document(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     3. LLMで情報抽出
     4. 抽出情報の後処理 (OCRレスポンスも使用)
     5. SQSへ結果送信
+
+    レコードおよびレコード内の画像はasyncioで並行に処理する。
+    各処理はI/O待ちが大半のため、同期APIをスレッドで実行して待ち時間を重ね合わせる。
+
+    処理に失敗したレコードは batchItemFailures として返し、そのレコードのみSQSから再配信させる
+    (イベントソースで ReportBatchItemFailures を有効にしている前提)。
     """
     logger.info("Processing started")
-    logger.debug(f"Event: {event}")
+    logger.debug("Event: %s", event)
     try:
         # 環境変数からバケット名を取得 (serverless.ymlで定義されている想定)
         bucket_name = os.environ.get('S3_BUCKET_NAME')
@@ -56,127 +130,368 @@ def process_document(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             logger.warning("No records found in the event")
             raise ValueError("No records found in the event")
 
-        results: List[ProcessResult] = []
-
-        for record in records:
-            current_sqs_message_id = record.get('messageId', 'unknown_sqs_message_id')
-            try:
-                message_body_str = record.get('body', '{}')
-                message_body = json.loads(message_body_str)
-                logger.info(f"Processing SQS message body: {message_body} (Message ID: {current_sqs_message_id})")
-
-                clipping_request_id_from_message = message_body.get("clipping_request_id")
-                image_urls = message_body.get('images', [])
-
-                if not image_urls:
-                    logger.warning(f"No image_urls found in message body for SQS message ID: {current_sqs_message_id}. Body: {message_body_str}")
-                    raise ValueError(f"No image_urls found in SQS message body for message ID: {current_sqs_message_id}")
-
-                for image_info in image_urls:
-                    object_key = image_info.get('s3_key')
-                    image_index = image_info.get('index', 'N/A')
-                    local_file_path = None  # Initialize local_file_path
-
-                    if not object_key:
-                        logger.warning(f"Missing s3_key in image_info (index: {image_index}) for request: {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}. Image Info: {image_info}")
-                        raise ValueError(f"Missing s3_key in image_info (index: {image_index}) for request: {clipping_request_id_from_message}")
-                    # S3から画像/PDFをダウンロード
-                    try:
-                        logger.info(f"Processing s3_key: {object_key} (index: {image_index}) for request: {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}")
-
-                        local_file_path = download_file(bucket_name, object_key)
-                        ocr_response = extract_text(local_file_path)
-
-                        if not ocr_response:
-                            logger.warning(f"No OCR data found for {object_key} (index: {image_index}). Skipping this item.")
-                            results.append({
-                                "file": object_key,
-                                "status": "skipped",
-                                "message_id": None,
-                                "error": "No text detected by OCR"
-                            })
-                            continue
-                    except Exception as e_s3_item:
-                        logger.exception(f"Error processing s3_key {object_key} (index: {image_index}) for request {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}: {str(e_s3_item)}")
-                        # Re-raise the exception after logging, to be caught by the outer try-except
-                        raise e_s3_item
-                    # OCRレスポンスを変換
-                    try:
-                        converted_ocr_data = convert_bounding_box_format(ocr_response)
-
-                        if not converted_ocr_data:
-                            logger.warning(f"OCR data became invalid after conversion for {object_key} (index: {image_index}). Skipping this item.")
-                            results.append({
-                                "file": object_key,
-                                "status": "skipped",
-                                "message_id": None,
-                                "error": "OCR data conversion failed or resulted in empty data"
-                            })
-                            continue
-                        logger.info(f"Converted OCR data for {object_key} (index: {image_index}): {converted_ocr_data}")
-
-                        # LLMで情報抽出
-                        extracted_info = extract_information(converted_ocr_data)
-                        logger.info(f"Extracted information for {object_key} (index: {image_index}): {extracted_info}")
-
-                        # LLM処理結果とOCR結果を結合
-                        combined_output = {
-                            "llm_output": extracted_info,
-                            "ocr_output": converted_ocr_data
-                        }
-                    except Exception as e_llm:
-                        logger.error(f"Error during LLM processing for {object_key} (index: {image_index}): {str(e_llm)}")
-                        raise e_llm
-                    # LLM処理結果をS3にアップロード
-                    try:
-                        llm_output_bucket_name = os.environ.get('LLM_OUTPUT_S3_BUCKET_NAME')
-                        if llm_output_bucket_name:
-                            llm_output_s3_key = f"{clipping_request_id_from_message}/{object_key}_combined_output.json"
-                            upload_to_s3(json.dumps(combined_output, ensure_ascii=False), llm_output_bucket_name, llm_output_s3_key)
-                        else:
-                            logger.warning("LLM_OUTPUT_S3_BUCKET_NAME environment variable is not set. Skipping LLM output upload to S3.")
-                    except Exception as e_upload:
-                        logger.error(f"Error uploading LLM output to S3 for {object_key} (index: {image_index}): {str(e_upload)}")
-                        raise e_upload
-
-                    try:
-                        current_clipping_request_id_for_processor = clipping_request_id_from_message or \
-                                                                    (context.aws_request_id if hasattr(context, 'aws_request_id') else "unknown_request_id")
-
-                        processed_data = process_extracted_data(extracted_info, ocr_response, current_clipping_request_id_for_processor, object_key)
-                        logger.info(f"Processed data for {object_key} (index: {image_index}): {processed_data}")
-
-                        final_sqs_message = format_sqs_message(processed_data, clipping_request_id_from_message, object_key)
-                        message_id_sent = send_to_queue(final_sqs_message)
-
-                        results.append({
-                            "file": object_key,
-                            "status": final_sqs_message.get("status", "error"),
-                            "message_id": message_id_sent,
-                            "error": final_sqs_message.get("error_message")
-                        })
-                    except Exception as e_processor:
-                        logger.exception(f"Error processing extracted data for {object_key} (index: {image_index}) for request {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}: {str(e_processor)}")
-                        raise e_processor
-                    finally:
-                        if local_file_path and os.path.exists(local_file_path):
-                            try:
-                                os.remove(local_file_path)
-                                logger.info(f"Successfully deleted temporary file: {local_file_path}")
-                            except OSError as e_remove:
-                                logger.error(f"Error deleting temporary file {local_file_path}: {str(e_remove)}")
-            except Exception as e_sqs_record:
-                logger.exception(f"Error processing SQS record (Message ID: {current_sqs_message_id}): {str(e_sqs_record)}")
-                raise e_sqs_record
+        # LLM処理結果のアップロード先 (画像ごとに参照しないよう1回だけ取得する)
+        llm_output_bucket_name = os.environ.get('LLM_OUTPUT_S3_BUCKET_NAME')
+        if not llm_output_bucket_name:
+            logger.warning("LLM_OUTPUT_S3_BUCKET_NAME environment variable is not set. Skipping LLM output upload to S3.")
+
+        results, batch_item_failures = asyncio.run(_process_records(records, context, bucket_name, llm_output_bucket_name))
+
+        if batch_item_failures:
+            message = f"Processing failed for {len(batch_item_failures)} of {len(records)} record(s)"
+        else:
+            message = "Processing completed successfully for all records"
 
         return {
             "statusCode": 200,
-            "body": json.dumps({
-                "message": "Processing completed successfully for all records",
+            "body": orjson.dumps({
+                "message": message,
                 "results": results
-            })
+            }).decode(),
+            "batchItemFailures": batch_item_failures
         }
 
     except Exception as e:
         logger.exception(f"Critical error in handler: {str(e)}")
-        raise e
+        raise
+
+async def _process_records(records: List[Dict[str, Any]], context: Any, bucket_name: str,
+                           llm_output_bucket_name: str | None) -> Tuple[List[ProcessResult], List[Dict[str, str]]]:
+    """
+    全SQSレコードを並行して処理し、画像ごとの処理結果をレコード順に結合して返す。
+    SQSへの送信は全画像の処理後にSendMessageBatchでまとめて行う。
+
+    Returns:
+        tuple: 成功したレコードの画像ごとの処理結果と、失敗したレコードの batchItemFailures の組
+    """
+    # asyncio.to_thread はループのデフォルトExecutorを使う (asyncio.run の終了時にシャットダウンされる)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=IO_THREAD_POOL_SIZE, thread_name_prefix="clipping-io")
+    )
+    ocr_semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+    download_semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    llm_queue = None
+    if LLM_BATCH_SIZE > 1:
+        # レコードをまたいで同時期に届いた画像のLLMによる情報抽出をまとめる
+        llm_queue = AsyncBatchQueue(extract_information_batch, LLM_BATCH_SIZE, LLM_BATCH_MAX_WAIT_MS / 1000)
+    # 1件のレコードの失敗で他のレコードの処理結果が失われないよう、例外も結果として受け取る
+    record_outcomes = await asyncio.gather(
+        *(_process_record(record, context, bucket_name, llm_output_bucket_name, ocr_semaphore, download_semaphore, llm_queue)
+          for record in records),
+        return_exceptions=True
+    )
+    failed_record_indices = {index for index, image_outcomes in enumerate(record_outcomes) if isinstance(image_outcomes, BaseException)}
+
+    # 送信対象のメッセージをまとめてSQSへ送信し、メッセージIDを結果に反映
+    # (レコードのインデックス, 結果, メッセージ) の組
+    pending = [(index, result, message)
+               for index, image_outcomes in enumerate(record_outcomes) if index not in failed_record_indices
+               for result, message in image_outcomes if message is not None]
+    if pending:
+        message_ids = await asyncio.to_thread(send_batch_to_queue, [message for _, _, message in pending])
+        for (index, result, _), message_id in zip(pending, message_ids):
+            result.message_id = message_id
+            # 送信できなかったメッセージのレコードのみ再配信させる (送信済みのレコードは再配信せず、重複送信を避ける)
+            if message_id is None:
+                failed_record_indices.add(index)
+
+    results = []
+    batch_item_failures = []
+    for index, (record, image_outcomes) in enumerate(zip(records, record_outcomes)):
+        if index in failed_record_indices:
+            batch_item_failures.append({"itemIdentifier": record.get('messageId')})
+        else:
+            results.extend(result for result, _ in image_outcomes)
+
+    return results, batch_item_failures
+
+async def _process_record(record: Dict[str, Any], context: Any, bucket_name: str, llm_output_bucket_name: str | None,
+                          ocr_semaphore: asyncio.Semaphore, download_semaphore: asyncio.Semaphore,
+                          llm_queue: AsyncBatchQueue | None = None) -> List[Tuple[ProcessResult, Dict[str, Any] | None]]:
+    """
+    1件のSQSレコードを処理する。
+    メッセージ内の画像は並行してダウンロードし、OCRはまとめて1回のバッチリクエストで行った後、
+    LLM以降の処理を画像ごとに並行して行う。
+    """
+    current_sqs_message_id = record.get('messageId', 'unknown_sqs_message_id')
+    try:
+        message_body_str = record.get('body') or '{}'
+        logger.info("Processing SQS message body: %s (Message ID: %s)", message_body_str, current_sqs_message_id)
+        try:
+            message_body = _decode_message_body(message_body_str)
+        except msgspec.DecodeError as e_decode:
+            raise ValueError(f"Invalid SQS message body for message ID: {current_sqs_message_id}: {str(e_decode)}") from e_decode
+
+        clipping_request_id_from_message = message_body.clipping_request_id
+        image_urls = message_body.images
+
+        if not image_urls:
+            logger.warning(f"No image_urls found in message body for SQS message ID: {current_sqs_message_id}. Body: {message_body_str}")
+            raise ValueError(f"No image_urls found in SQS message body for message ID: {current_sqs_message_id}")
+
+        image_refs = [(image_info.s3_key, image_info.index) for image_info in image_urls]
+        for (object_key, image_index), image_info in zip(image_refs, image_urls):
+            if not object_key:
+                logger.warning(f"Missing s3_key in image_info (index: {image_index}) for request: {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}. Image Info: {image_info}")
+                raise ValueError(f"Missing s3_key in image_info (index: {image_index}) for request: {clipping_request_id_from_message}")
+
+        # 後処理で使うリクエストIDはレコード内で共通のため1回だけ決定する
+        processor_request_id = clipping_request_id_from_message or getattr(context, 'aws_request_id', "unknown_request_id")
+
+        ocr_responses = await _extract_ocr_responses(image_refs, bucket_name, clipping_request_id_from_message,
+                                                     current_sqs_message_id, ocr_semaphore, download_semaphore)
+
+        return list(await asyncio.gather(
+            *(_process_image(object_key, image_index, ocr_response, clipping_request_id_from_message,
+                             current_sqs_message_id, processor_request_id, llm_output_bucket_name, ocr_semaphore, llm_queue)
+              for (object_key, image_index), ocr_response in zip(image_refs, ocr_responses))
+        ))
+    except Exception as e_sqs_record:
+        logger.exception(f"Error processing SQS record (Message ID: {current_sqs_message_id}): {str(e_sqs_record)}")
+        raise
+
+async def _extract_ocr_responses(image_refs: List[Tuple[str, Any]], bucket_name: str, clipping_request_id_from_message: str | None,
+                                 current_sqs_message_id: str, ocr_semaphore: asyncio.Semaphore,
+                                 download_semaphore: asyncio.Semaphore) -> List[Any]:
+    """
+    レコード内の全画像のOCR結果を画像の順に返す。
+    キャッシュ済みの画像 (同じETag) はダウンロードとOCRを省略し、
+    それ以外はレコード内で重複を除いてダウンロードし、まとめて1回のバッチリクエストでOCRを行う。
+    別のキーで再アップロードされたファイルなど、内容が同じファイルはダウンロード後にハッシュで照合してOCRを省略する。
+    """
+    ocr_responses: List[Any] = [_CACHE_MISS] * len(image_refs)
+    cache_keys: List[Any] = [None] * len(image_refs)
+    # キャッシュにない画像を、同じオブジェクトは1回だけダウンロード・OCRする
+    pending: Dict[Any, List[int]] = {}
+    downloads: Dict[Any, asyncio.Future] = {}
+
+    async def _lookup(i: int) -> None:
+        object_key, image_index = image_refs[i]
+        if OCR_CACHE_SIZE > 0:
+            etag = await _get_image_etag(object_key, image_index, bucket_name, clipping_request_id_from_message,
+                                         current_sqs_message_id, download_semaphore)
+            cache_keys[i] = (bucket_name, object_key, etag)
+            ocr_responses[i] = _ocr_cache.get(cache_keys[i], _CACHE_MISS)
+            if ocr_responses[i] is not _CACHE_MISS:
+                return
+
+        # 他の画像のHEADを待たず、キャッシュにないと分かった時点でダウンロードを開始する
+        cache_key = cache_keys[i] or (bucket_name, object_key)
+        pending.setdefault(cache_key, []).append(i)
+        if cache_key not in downloads:
+            downloads[cache_key] = asyncio.ensure_future(
+                _download_image(object_key, image_index, bucket_name, clipping_request_id_from_message, current_sqs_message_id,
+                                download_semaphore)
+            )
+
+    lookup_outcomes = await asyncio.gather(*(_lookup(i) for i in range(len(image_refs))), return_exceptions=True)
+    download_outcomes = await asyncio.gather(*downloads.values(), return_exceptions=True)
+    for outcome in (*lookup_outcomes, *download_outcomes):
+        if isinstance(outcome, BaseException):
+            raise outcome
+    downloaded = dict(zip(downloads.keys(), download_outcomes))
+
+    # HEADの完了順によらず、画像の順に並べる
+    pending = {cache_key: sorted(indices) for cache_key, indices in sorted(pending.items(), key=lambda item: min(item[1]))}
+
+    if len(pending) < len(image_refs):
+        logger.info("Reusing OCR results for %s of %s image(s) (SQS message ID: %s)",
+                    len(image_refs) - sum(len(indices) for indices in pending.values()), len(image_refs), current_sqs_message_id)
+    if not pending:
+        return ocr_responses
+
+    first_indices = [indices[0] for indices in pending.values()]
+    contents = [downloaded[cache_key] for cache_key in pending]
+
+    batch_responses: List[Any] = [_CACHE_MISS] * len(contents)
+    content_keys: List[Any] = [None] * len(contents)
+    if OCR_CACHE_SIZE > 0:
+        content_keys = [_content_cache_key(content) for content in contents]
+        batch_responses = [_ocr_cache.get(content_key, _CACHE_MISS) for content_key in content_keys]
+
+    # 内容が同じファイルは1回だけOCRする
+    content_pending: Dict[Any, List[int]] = {}
+    for j, ocr_response in enumerate(batch_responses):
+        if ocr_response is _CACHE_MISS:
+            content_pending.setdefault(content_keys[j] or j, []).append(j)
+
+    if len(content_pending) < len(contents):
+        logger.info("Reusing OCR results for %s of %s downloaded file(s) with identical content (SQS message ID: %s)",
+                    len(contents) - len(content_pending), len(contents), current_sqs_message_id)
+
+    if content_pending:
+        # OCR処理 (レコード内の画像をまとめて1回のバッチリクエストで処理)
+        try:
+            async with ocr_semaphore:
+                ocr_results = await asyncio.to_thread(
+                    extract_text_batch, [(contents[js[0]], image_refs[first_indices[js[0]]][0]) for js in content_pending.values()]
+                )
+        except Exception as e_ocr:
+            logger.exception(f"Error extracting OCR data for request {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}: {str(e_ocr)}")
+            raise
+
+        for (content_key, js), ocr_response in zip(content_pending.items(), ocr_results):
+            if content_keys[js[0]] is not None:
+                _ocr_cache.put(content_key, ocr_response)
+            for j in js:
+                batch_responses[j] = ocr_response
+
+    for (cache_key, indices), ocr_response in zip(pending.items(), batch_responses):
+        if cache_keys[indices[0]] is not None:
+            _ocr_cache.put(cache_key, ocr_response)
+        for i in indices:
+            ocr_responses[i] = ocr_response
+
+    return ocr_responses
+
+def _content_cache_key(content: bytes) -> Tuple[str, bytes]:
+    """
+    ファイル内容のハッシュ (BLAKE2b) からOCR結果のキャッシュキーを作成する
+    """
+    return ("blake2b", hashlib.blake2b(content, digest_size=32).digest())
+
+async def _get_image_etag(object_key: str, image_index: Any, bucket_name: str, clipping_request_id_from_message: str | None,
+                          current_sqs_message_id: str, download_semaphore: asyncio.Semaphore) -> str:
+    """
+    OCR結果のキャッシュキーに使うため、1画像分のS3オブジェクトのETagを取得する
+    """
+    try:
+        async with download_semaphore:
+            return await asyncio.to_thread(get_object_etag, bucket_name, object_key)
+    except Exception as e_head:
+        logger.exception(f"Error processing s3_key {object_key} (index: {image_index}) for request {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}: {str(e_head)}")
+        raise
+
+async def _download_image(object_key: str, image_index: Any, bucket_name: str, clipping_request_id_from_message: str | None,
+                          current_sqs_message_id: str, download_semaphore: asyncio.Semaphore) -> bytes:
+    """
+    1画像分のファイルをS3からダウンロードする。
+    S3ダウンロードはOCR/LLMの同時実行数とは別枠で行い、
+    他のレコードのOCR/LLM待ちの間にダウンロードを済ませておく。
+    """
+    # S3から画像/PDFをダウンロード
+    try:
+        logger.info("Processing s3_key: %s (index: %s) for request: %s, SQS message ID: %s", object_key, image_index, clipping_request_id_from_message, current_sqs_message_id)
+        async with download_semaphore:
+            content = await asyncio.to_thread(download_bytes, bucket_name, object_key)
+    except Exception as e_download:
+        logger.exception(f"Error processing s3_key {object_key} (index: {image_index}) for request {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}: {str(e_download)}")
+        raise
+
+    return content
+
+async def _process_image(object_key: str, image_index: Any, ocr_response: Any, clipping_request_id_from_message: str | None,
+                         current_sqs_message_id: str, processor_request_id: str, llm_output_bucket_name: str | None,
+                         semaphore: asyncio.Semaphore, llm_queue: AsyncBatchQueue | None) -> Tuple[ProcessResult, Dict[str, Any] | None]:
+    """
+    セマフォで同時実行数を制限しつつ、OCR済みの1画像分の処理 (OCRデータ変換 → LLM → 後処理) を行う。
+    llm_queue が指定されている場合、LLMによる情報抽出は他の画像とまとめて行い、
+    まとめたリクエストが失敗した場合は画像ごとのリクエストにフォールバックする。
+    """
+    if not ocr_response:
+        logger.warning(f"No OCR data found for {object_key} (index: {image_index}). Skipping this item.")
+        return _result(object_key, "skipped", error="No text detected by OCR"), None
+
+    async with semaphore:
+        try:
+            # OCRレスポンスを変換
+            converted_ocr_data = await asyncio.to_thread(convert_bounding_box_format, ocr_response)
+
+            if not converted_ocr_data:
+                logger.warning(f"OCR data became invalid after conversion for {object_key} (index: {image_index}). Skipping this item.")
+                return _result(object_key, "skipped", error="OCR data conversion failed or resulted in empty data"), None
+            logger.debug("Converted OCR data for %s (index: %s): %s", object_key, image_index, converted_ocr_data)
+
+            # LLMで情報抽出
+            extracted_info = None
+            if llm_queue is not None:
+                try:
+                    extracted_info = await llm_queue.submit(converted_ocr_data)
+                except Exception as e_batch:
+                    # まとめたリクエスト自体が失敗した場合は、画像ごとのリクエストで抽出し直す
+                    logger.warning(f"Batched LLM request failed for {object_key} (index: {image_index}), "
+                                   f"retrying individually: {str(e_batch)}")
+            if extracted_info is None:
+                extracted_info = await asyncio.to_thread(extract_information, converted_ocr_data)
+            logger.info("Extracted information for %s (index: %s): %s", object_key, image_index, extracted_info)
+        except Exception as e_llm:
+            logger.error(f"Error during LLM processing for {object_key} (index: {image_index}): {str(e_llm)}")
+            raise
+
+        process_image = asyncio.to_thread(_process_image_sync, object_key, image_index, ocr_response, extracted_info,
+                                          clipping_request_id_from_message, current_sqs_message_id, processor_request_id)
+        if not llm_output_bucket_name:
+            return await process_image
+
+        # LLM処理結果のS3へのアップロードは後処理で使わないため、後処理と並行して行う
+        # (後処理は抽出結果をコピーして補正するため、アップロード中の抽出結果は変更されない)
+        _, outcome = await asyncio.gather(
+            asyncio.to_thread(_upload_combined_output, object_key, image_index, converted_ocr_data, extracted_info,
+                              clipping_request_id_from_message, llm_output_bucket_name),
+            process_image
+        )
+        return outcome
+
+def _upload_combined_output(object_key: str, image_index: Any, converted_ocr_data: Any, extracted_info: Dict[str, Any],
+                            clipping_request_id_from_message: str | None, llm_output_bucket_name: str) -> None:
+    """
+    1画像分のLLM処理結果とOCR結果を結合してS3にアップロードする
+    """
+    # LLM処理結果とOCR結果を結合
+    combined_output = {
+        "llm_output": extracted_info,
+        "ocr_output": converted_ocr_data
+    }
+    # LLM処理結果をS3にアップロード
+    try:
+        llm_output_s3_key = f"{clipping_request_id_from_message}/{object_key}_combined_output.json"
+        data = orjson.dumps(combined_output)
+        if LLM_OUTPUT_COMPRESSION == "gzip":
+            # OCR結果を含むJSONは冗長なため圧縮して転送量を減らす (キーは変えず、Content-Encodingで示す)
+            upload_to_s3(gzip.compress(data, compresslevel=5, mtime=0), llm_output_bucket_name, llm_output_s3_key,
+                         content_encoding="gzip")
+        else:
+            upload_to_s3(data, llm_output_bucket_name, llm_output_s3_key)
+    except Exception as e_upload:
+        logger.error(f"Error uploading LLM output to S3 for {object_key} (index: {image_index}): {str(e_upload)}")
+        raise
+
+def _process_image_sync(object_key: str, image_index: Any, ocr_response: Any, extracted_info: Dict[str, Any],
+                        clipping_request_id_from_message: str | None, current_sqs_message_id: str,
+                        processor_request_id: str) -> Tuple[ProcessResult, Dict[str, Any] | None]:
+    """
+    LLMで情報抽出済みの1画像分の後処理 (後処理 → SQSメッセージ作成) を行う
+
+    Returns:
+        tuple: 処理結果と、SQSに送信するメッセージの組
+    """
+    try:
+        processed_data = process_extracted_data(extracted_info, ocr_response, processor_request_id, object_key)
+        logger.info("Processed data for %s (index: %s): %s", object_key, image_index, processed_data)
+
+        final_sqs_message = format_sqs_message(processed_data, clipping_request_id_from_message, object_key)
+
+        # message_id はSQSへのバッチ送信後に設定する
+        return _result(object_key, final_sqs_message.get("status", "error"),
+                       error=final_sqs_message.get("error_message")), final_sqs_message
+    except Exception as e_processor:
+        logger.exception(f"Error processing extracted data for {object_key} (index: {image_index}) for request {clipping_request_id_from_message}, SQS message ID: {current_sqs_message_id}: {str(e_processor)}")
+        raise
+
+def _prewarm_clients() -> None:
+    """
+    S3/SQS/Visionのクライアントと、Vertex AIの初期化・Geminiモデルの作成を先に済ませておく。
+    Lambdaの初期化フェーズで実行し、コールドスタート後の最初の画像でのSDKの読み込みや認証の待ち時間をなくす。
+    失敗した場合も処理時に改めて作成されるため、警告のみ出力する。
+    """
+    try:
+        get_s3_client()
+        get_sqs_client()
+        get_vision_client()
+        prewarm_generative_model()
+        logger.info("Prewarmed clients and generative model")
+    except Exception as e:
+        logger.warning(f"Failed to prewarm clients: {str(e)}")
+
+if PREWARM_CLIENTS:
+    _prewarm_clients()
@@ -5,7 +5,7 @@ Python 3.12の新機能を活用して最適化
 """
 import os
 import sys
-import json
+import orjson
 import argparse
 from datetime import datetime
 from pathlib import Path
@@ -148,10 +148,10 @@ def main():
                 print("\nLLMによる抽出情報:")
                 # トークン情報を抽出して表示
                 usage_metadata = extracted_info.pop('usage_metadata', None) # 抽出情報本体から削除しつつ取得
-                print(json.dumps(extracted_info, indent=2, ensure_ascii=False)) # 本体を表示
+                print(orjson.dumps(extracted_info, option=orjson.OPT_INDENT_2).decode()) # 本体を表示
                 if usage_metadata:
                     print("\nLLMトークン使用量:")
-                    print(json.dumps(usage_metadata, indent=2))
+                    print(orjson.dumps(usage_metadata, option=orjson.OPT_INDENT_2).decode())
                 else:
                     print("\nLLMトークン使用量: 情報なし")
 
@@ -166,7 +166,7 @@ def main():
                     s3_key=dummy_s3_key
                 )
                 print("\nProcessor処理結果:")
-                print(json.dumps(processed_data, indent=2, ensure_ascii=False))
+                print(orjson.dumps(processed_data, option=orjson.OPT_INDENT_2).decode())
 
                 # 4. SQSメッセージ形式へのフォーマット
                 print_section("最終フォーマット (Formatter)")
@@ -184,7 +184,7 @@ def main():
         else:
             print("\nFormatter処理結果 (最終SQSメッセージ形式):")
             try:
-                result_json = json.dumps(formatted_message, indent=2, ensure_ascii=False)
+                result_json = orjson.dumps(formatted_message, option=orjson.OPT_INDENT_2).decode()
                 print(result_json)
 
                 if args.output:
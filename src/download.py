@@ -1,10 +1,17 @@
 import os
-import boto3
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
 from src.utils.logger import setup_logger
+from src.utils.clients import get_s3_client
 
 logger = setup_logger()
 
+# 範囲指定GETの1パートあたりのサイズ。これ以下のオブジェクトは1回のGETで取得する
+S3_RANGE_PART_SIZE = 8 * 1024 * 1024
+# 1オブジェクトあたりの範囲指定GETの同時実行数
+S3_RANGE_MAX_CONCURRENCY = 8
+
 def download_file(bucket_name, object_key):
     """
     S3バケットから画像またはPDFファイルをダウンロードする
@@ -18,8 +25,8 @@ def download_file(bucket_name, object_key):
     """
     logger.info(f"Downloading file: {object_key} from bucket: {bucket_name}")
     
-    # S3クライアントの初期化
-    s3_client = boto3.client('s3')
+    # S3クライアントの取得 (ウォームスタート間で共有)
+    s3_client = get_s3_client()
     
     # ファイル拡張子を取得
     _, file_extension = os.path.splitext(object_key)
@@ -37,7 +44,88 @@ def download_file(bucket_name, object_key):
     
     except Exception as e:
         logger.error(f"Error downloading file from S3: {str(e)}")
-        # 一時ファイルの削除
-        if os.path.exists(local_file_path):
-            os.remove(local_file_path)
-        raise
\ No newline at end of file
+        # 一時ファイルの削除 (存在確認をせずに削除し、存在しない場合は無視する)
+        try:
+            os.unlink(local_file_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def download_bytes(bucket_name, object_key):
+    """
+    S3バケットから画像またはPDFファイルをメモリ上に読み込む
+    一時ファイルへの書き込み・再読み込みを行わないため、Vision APIへ直接渡す場合はこちらを使う
+
+    Args:
+        bucket_name (str): S3バケット名
+        object_key (str): S3オブジェクトキー
+
+    Returns:
+        bytes: ファイルの内容
+
+    Note:
+        最初のパートを範囲指定GETで取得し、オブジェクト全体がS3_RANGE_PART_SIZEを超える場合は
+        残りのパートを並行して取得する (大きなPDFで1接続の帯域に律速されないようにする)。
+        小さなオブジェクトは追加のリクエストなしに1回のGETで取得できる。
+    """
+    logger.info(f"Downloading object: {object_key} from bucket: {bucket_name} into memory")
+
+    s3_client = get_s3_client()
+
+    try:
+        try:
+            response = s3_client.get_object(Bucket=bucket_name, Key=object_key, Range=f"bytes=0-{S3_RANGE_PART_SIZE - 1}")
+        except ClientError as e:
+            # 0バイトのオブジェクトは範囲指定できないため、通常のGETで取得する
+            if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+                raise
+            response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+            return response['Body'].read()
+
+        first_part = response['Body'].read()
+        # ContentRange: "bytes 0-8388607/20000000"
+        total_size = int(response['ContentRange'].rsplit('/', 1)[1]) if response.get('ContentRange') else len(first_part)
+
+        if total_size <= len(first_part):
+            content = first_part
+        else:
+            # 取得中にオブジェクトが更新された場合に混在しないよう、ETagを指定して残りのパートを取得する
+            etag = response['ETag']
+            ranges = [(start, min(start + S3_RANGE_PART_SIZE, total_size) - 1)
+                      for start in range(len(first_part), total_size, S3_RANGE_PART_SIZE)]
+
+            def _get_part(byte_range):
+                part = s3_client.get_object(Bucket=bucket_name, Key=object_key, IfMatch=etag,
+                                            Range=f"bytes={byte_range[0]}-{byte_range[1]}")
+                return part['Body'].read()
+
+            with ThreadPoolExecutor(max_workers=min(len(ranges), S3_RANGE_MAX_CONCURRENCY)) as executor:
+                content = b"".join([first_part, *executor.map(_get_part, ranges)])
+
+        logger.info(f"Object downloaded successfully: {object_key} ({len(content)} bytes)")
+        return content
+
+    except Exception as e:
+        logger.error(f"Error downloading object from S3: {str(e)}")
+        raise
+
+def get_object_etag(bucket_name, object_key):
+    """
+    S3オブジェクトのETagを取得する (本体はダウンロードしない)
+
+    Args:
+        bucket_name (str): S3バケット名
+        object_key (str): S3オブジェクトキー
+
+    Returns:
+        str: オブジェクトのETag
+    """
+    s3_client = get_s3_client()
+
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        return response['ETag']
+
+    except Exception as e:
+        logger.error(f"Error getting object metadata from S3: {str(e)}")
+        raise
@@ -1,3 +1,4 @@
+import math
 from typing import List, Dict, Any, Optional
 from src.utils.logger import setup_logger
 
@@ -9,7 +10,7 @@ def create_clip_item(field_name: str, value: Any, bbox: Optional[Dict[str, float
     bbox がない、または不正な場合は None を返す。
     """
     if bbox is None:
-        logger.debug(f"Skipping clip item for '{field_name}' due to missing bounding box.")
+        logger.debug("Skipping clip item for '%s' due to missing bounding box.", field_name)
         return None
 
     # bbox の形式を検証 (x, y, width, height が存在するか)
@@ -18,8 +19,8 @@ def create_clip_item(field_name: str, value: Any, bbox: Optional[Dict[str, float
     width = bbox.get('width')
     height = bbox.get('height')
 
-    if None in [x_min, y_min, width, height] or width < 0 or height < 0:
-        logger.warning(f"Invalid bbox format for field '{field_name}': {bbox}. Skipping clip item.")
+    if x_min is None or y_min is None or width is None or height is None or width < 0 or height < 0:
+        logger.warning("Invalid bbox format for field '%s': %s. Skipping clip item.", field_name, bbox)
         return None
 
     x_max = x_min + width
@@ -27,12 +28,13 @@ def create_clip_item(field_name: str, value: Any, bbox: Optional[Dict[str, float
 
     # 座標値が負でないことを確認 (オプションだが推奨)
     if x_min < 0 or y_min < 0 or x_max < 0 or y_max < 0:
-        logger.warning(f"Negative coordinate values in bbox for field '{field_name}': {bbox}. Proceeding, but check OCR/LLM output.")
+        logger.warning("Negative coordinate values in bbox for field '%s': %s. Proceeding, but check OCR/LLM output.", field_name, bbox)
         # ここでは処理を続けるが、ログには残す
 
     clip_item = {
         "field_name": field_name,
-        "value": str(value) if value is not None else "", # 値は文字列に変換 (内部処理用)
+        # 値は文字列に変換 (内部処理用)。LLMの出力は文字列が大半のため、str の場合は変換しない
+        "value": value if type(value) is str else ("" if value is None else str(value)),
         "position": {
             # 座標は4点のリスト形式で表現
             "bounding_box": [
@@ -49,174 +51,318 @@ def create_clip_item(field_name: str, value: Any, bbox: Optional[Dict[str, float
 
     return clip_item
 
+def _create_internal_clip(field_name: str, value: Any, bbox: Optional[Dict[str, float]], confidence: Optional[float] = None,
+                          page: Optional[int] = 0) -> Optional[Dict[str, Any]]:
+    """
+    create_clip_item でクリップアイテムを作成し、format_sqs_message で使う (x, y, width, height) を '_bbox' として保持する。
+    """
+    clip = create_clip_item(field_name, value, bbox, confidence, page)
+    if clip:
+        clip["_bbox"] = (bbox['x'], bbox['y'], bbox['width'], bbox['height'])
+    return clip
+
+# 辞書の子要素として探索しないキー ('value', 'bbox', 'confidence', 'name', 'page' は既に処理済みか、キーとして使用しない)
+_NON_CHILD_KEYS = frozenset(["value", "bbox", "confidence", "name", "page"])
+
+# 出力用のフィールド名に変換するフィールド
+_FIELD_NAME_MAPPING = {
+    "bank_details": "bank", # bank_details 自体の場合
+    "amount_info.amount_withholding": "withholding_tax_amount",
+    "amount_info.tax_free_amount": "taxable_amount_for_0_percent",
+    "amount_info.total_amount": "total_amount",
+}
+# tax_breakdown の要素のうち、リスト処理側で税率ごとのフィールド名でクリップする項目
+_TAX_BREAKDOWN_KEY = "amount_info.tax_breakdown"
+_TAX_BREAKDOWN_PREFIX = _TAX_BREAKDOWN_KEY + "."
+_TAX_BREAKDOWN_ITEM_KEYS = frozenset(["amount_include_tax", "amount_exclude_tax", "tax_amount", "taxable_amount", "tax_rate"])
+# このキーで始まる要素の配下は bank_details として専用に処理する
+_BANK_DETAILS_KEY = "bank_details"
+
+# 子要素として探索する型 (クリップを生成しうるのは辞書とリストのみ)
+_CONTAINER_TYPES = (dict, list)
+
+# 探索スタックの要素の種類
+_NODE = 0       # 通常の要素
+_TAX_ITEM = 1   # tax_rate を持つ amount_info.tax_breakdown の要素
+_BANK_NODE = 2  # bank_details 配下の要素
+
+def _field_clip(data: Dict[str, Any], parent_key: str, current_page: int) -> Optional[Dict[str, Any]]:
+    """
+    'value' と 'bbox' を持つ辞書要素をクリップアイテムに変換する。
+    フィールド名のマッピングルールを適用し、クリップ対象でない場合は None を返す。
+    bank_details 配下の要素は _bank_details_clip で処理するため、parent_key は bank_details で始まらない想定。
+    """
+    # "value" と "bbox" を持つフィールドを探索
+    if data.get("bbox") is None or "value" not in data:
+        return None
+
+    # フィールド名を決定: 'name' キーがあればそれを使用、なければ親キーを使用
+    field_name_part = data.get('name') # 'name' は通常、リスト内の要素のキー (例: 'bank_name')
+    # 親キーと name から基本的なフィールド名を構築
+    if parent_key and field_name_part:
+        base_field_name = f"{parent_key}.{field_name_part}"
+    elif field_name_part:
+        base_field_name = field_name_part
+    elif parent_key:
+        base_field_name = parent_key
+    else:
+        logger.warning("Could not determine base field name for data: %s. Skipping clip item.", data)
+        return None
+
+    logger.info("base_field_name: %s", base_field_name)
+    # --- マッピングルール ---
+    # amount_info.tax_breakdown の中の個別の金額項目はリスト処理側で処理
+    # (tax_breakdown 配下以外では先頭一致の判定1回で済むよう、末尾のキーの判定は後に行う)
+    if base_field_name.startswith(_TAX_BREAKDOWN_PREFIX) and \
+       base_field_name.rpartition(".")[2] in _TAX_BREAKDOWN_ITEM_KEYS:
+        logger.debug("Skipping direct clip for %s, handled by tax_breakdown list logic.", base_field_name)
+        return None
+    final_field_name = _FIELD_NAME_MAPPING.get(base_field_name, base_field_name)
+
+    return _create_internal_clip(
+        field_name=final_field_name,
+        value=data.get("value"),
+        bbox=data.get("bbox"),
+        confidence=data.get("confidence"),
+        page=current_page # ページ情報を渡す
+    )
+
+def _bank_details_clip(data: Dict[str, Any], parent_key: str, current_page: int) -> Optional[Dict[str, Any]]:
+    """
+    bank_details 配下の辞書要素をクリップアイテムに変換する。
+    bank_details の bbox を持つコンテナ自体 (またはその直下のリストの要素) のみを 'bank' としてクリップし、
+    その下の value/bbox を持つ要素はクリップしない (bank_details 自体の bbox を使うため)。
+    """
+    if parent_key != _BANK_DETAILS_KEY or data.get("bbox") is None or data.get("name"):
+        return None
+    return _create_internal_clip(
+        field_name=_FIELD_NAME_MAPPING[_BANK_DETAILS_KEY],
+        value=data.get("value"),
+        bbox=data["bbox"],
+        confidence=data.get("confidence"),
+        page=current_page
+    )
+
+def _is_duplicate_bank_clip(clip: Dict[str, Any], bank_seen: set) -> bool:
+    """
+    'bank' クリップについて、同じ bbox とページのクリップが既に出力されているかを判定し、未出力であれば bank_seen に記録する。
+    不正な bbox のクリップは重複とはみなさない (format_sqs_message 側で除外される)。
+    """
+    if clip["field_name"] != "bank":
+        return False
+    box = _clip_box(clip)
+    if box is None:
+        return False
+    bank_key = (*box, clip["page"])
+    if bank_key in bank_seen:
+        logger.debug("Skipping duplicate bank clip for bbox: %s", bank_key)
+        return True
+    bank_seen.add(bank_key)
+    return False
+
+# tax_breakdown の要素の項目と、税率ごとのフィールド名の接頭辞の対応 (順に走査するだけのためタプルで保持する)
+_TAX_ITEM_FIELD_MAP = (
+    ("amount_consumption_tax", "tax_amount"),
+    ("amount_exclude_tax", "amount_without_tax"),
+)
+
+# 税率 (千分率) と、税率ごとのフィールド名の接尾辞の対応
+_RATE_SUFFIX = {
+    100: "_for_10_percent",
+    80: "_for_8_percent",
+    0: "_for_0_percent",
+}
+
+def _is_tax_field(tax_field: Any) -> bool:
+    """
+    tax_breakdown の要素の項目が 'value' と 'bbox' を持つ辞書かを判定する
+    """
+    return isinstance(tax_field, dict) and "value" in tax_field and "bbox" in tax_field
+
+def _tax_field_clip(field_name: str, tax_field: Dict[str, Any], item_page: int) -> Optional[Dict[str, Any]]:
+    """
+    tax_breakdown の要素の項目から、税率ごとのフィールド名でクリップアイテムを作成する
+    """
+    return _create_internal_clip(
+        field_name=field_name,
+        value=tax_field["value"],
+        bbox=tax_field["bbox"],
+        confidence=tax_field.get("confidence"),
+        page=item_page
+    )
+
+def _append_tax_breakdown_item_clips(item: Dict[str, Any], item_page: int, clips: List[Dict[str, Any]]) -> None:
+    """
+    tax_rate を持つ amount_info.tax_breakdown の要素から、税率ごとのフィールド名でクリップアイテムを作成し、clips に追加する。
+    """
+    tax_rate_data = item.get("tax_rate")
+    tax_rate = None
+    if isinstance(tax_rate_data, dict) and "value" in tax_rate_data:
+        try:
+            tax_rate = float(tax_rate_data["value"])
+        except (ValueError, TypeError):
+            logger.warning("Could not parse tax_rate value: %s", tax_rate_data.get('value'))
+    elif isinstance(tax_rate_data, (int, float, str)):
+        try:
+            tax_rate = float(tax_rate_data)
+        except (ValueError, TypeError):
+            logger.warning("Could not parse tax_rate value: %s", tax_rate_data)
+
+    rate_suffix = ""
+    # 対象の税率は 0〜0.1 のため、範囲外 (nan・inf を含む) は丸めずに対象外とする
+    if tax_rate is not None and -1 < tax_rate < 1:
+        # 千分率に丸めた値で引き、元の値との差が許容誤差内の場合のみ一致とする
+        rate_key = round(tax_rate * 1000)
+        if abs(tax_rate - rate_key / 1000) < 1e-9:
+            rate_suffix = _RATE_SUFFIX.get(rate_key, "")
+
+    if not rate_suffix:
+        logger.debug("Tax rate (%s) does not match 10%%, 8%%, or 0%%. Skipping specific tax field mapping for item: %s", tax_rate, item)
+        # 必要であれば、ここで item 内の他のフィールドを汎用クリップとして処理するロジックを追加
+        return
+
+    # Handle taxable_amount (preferring amount_include_tax)
+    taxable_amount = item.get("amount_include_tax")
+    if not _is_tax_field(taxable_amount):
+        taxable_amount = item.get("taxable_amount") # Fallback to taxable_amount
+    if _is_tax_field(taxable_amount):
+        clip = _tax_field_clip(f"taxable_amount{rate_suffix}", taxable_amount, item_page)
+        if clip:
+            clips.append(clip)
+
+    # Handle amount_consumption_tax and amount_exclude_tax
+    for source_field, target_base_field in _TAX_ITEM_FIELD_MAP:
+        tax_field = item.get(source_field)
+        if _is_tax_field(tax_field):
+            clip = _tax_field_clip(f"{target_base_field}{rate_suffix}", tax_field, item_page)
+            if clip:
+                clips.append(clip)
+
 def convert_to_clips_format_recursive(data: Any, parent_key: str = "", page: int = 0) -> List[Dict[str, Any]]:
     """
-    補正済みデータを再帰的に探索し、内部形式のクリップアイテムのリストを生成する。
+    補正済みデータを探索し、内部形式のクリップアイテムのリストを生成する。
     'value' と 'bbox' を持つ辞書要素をクリップアイテムに変換する。
     フィールド名のマッピングルールを適用する。
+
+    再帰呼び出しの代わりに明示的なスタックで深さ優先に探索する (関数呼び出しのオーバーヘッドと再帰の深さの上限を避ける)。
+    子要素は逆順にスタックに積み、出力の順序は元のデータの順序 (再帰で探索した場合と同じ) になる。
+    同じ bbox とページを持つ 'bank' クリップは最初の1つのみを出力する。
+    関数名は互換性のため変更していない。
     """
     clips = []
-    # ページ情報を抽出 (存在すれば)
-    current_page = data.get("page", page) if isinstance(data, dict) else page
-
-    if isinstance(data, dict):
-        # "value" と "bbox" を持つフィールド、または parent_key が "bank_details" で "bbox" を持つフィールドを探索
-        should_process_as_clip_candidate = False
-        if "bbox" in data and data["bbox"] is not None:
-            if "value" in data:
-                should_process_as_clip_candidate = True
-            elif parent_key == "bank_details": # bank_details の bbox を持つコンテナ自体をクリップ対象とする
-                should_process_as_clip_candidate = True
-
-        if should_process_as_clip_candidate:
-            # フィールド名を決定: 'name' キーがあればそれを使用、なければ親キーを使用
-            field_name_part = data.get('name') # 'name' は通常、リスト内の要素のキー (例: 'bank_name')
-            # 親キーと name から基本的なフィールド名を構築
-            if parent_key and field_name_part:
-                base_field_name = f"{parent_key}.{field_name_part}"
-            elif field_name_part:
-                base_field_name = field_name_part
-            elif parent_key:
-                base_field_name = parent_key
-            else:
-                base_field_name = None
-                logger.warning(f"Could not determine base field name for data: {data}. Skipping clip item.")
-
-            if base_field_name:
-                final_field_name = base_field_name
-                logger.info(f"base_field_name: {base_field_name}")
-                # --- マッピングルール ---
-                # bank_details の下の value/bbox を持つ要素はクリップしない (bank_details 自体の bbox を使うため)
-                if parent_key.startswith("bank_details") and base_field_name != "bank_details":
-                    logger.info(f"Skipping direct clip for {base_field_name} under bank_details, using bank_details.bbox instead.")
-                    final_field_name = None
-                elif base_field_name == "bank_details": # bank_details 自体の場合
-                    logger.info(f"base_field_name: {base_field_name}")
-                    final_field_name = "bank" # field_name を 'bank' にする
-                # amount_info.tax_breakdown の中の個別の金額項目はリスト処理側で処理
-                elif base_field_name.startswith("amount_info.tax_breakdown.") and \
-                     any(base_field_name.endswith("." + suffix) for suffix in ["amount_include_tax", "amount_exclude_tax", "tax_amount", "taxable_amount", "tax_rate"]):
-                    logger.debug(f"Skipping direct clip for {base_field_name}, handled by tax_breakdown list logic.")
-                    final_field_name = None
-                elif base_field_name == "amount_info.amount_withholding":
-                    final_field_name = "withholding_tax_amount"
-                elif base_field_name == "amount_info.tax_free_amount":
-                    final_field_name = "taxable_amount_for_0_percent"
-                elif base_field_name == "amount_info.total_amount":
-                    final_field_name = "total_amount"
-
-                if final_field_name:
-                    clip = create_clip_item(
-                        field_name=final_field_name,
-                        value=data.get("value"),
-                        bbox=data.get("bbox"),
-                        confidence=data.get("confidence"),
-                        page=current_page # ページ情報を渡す
-                    )
-                    if clip:
-                        # 'bank' フィールドの重複を避けるかどうかの考慮
-                        # 現状では重複を許容（複数の銀行情報 bbox があれば複数クリップされる）
-                        clips.append(clip)
-
-        # valueやbbox以外のキーも再帰的に探索
-        for key, value in data.items():
-            # 'value', 'bbox', 'confidence', 'name', 'page' は既に処理済みか、キーとして使用しない
-            if key not in ["value", "bbox", "confidence", "name", "page"]:
-                current_parent_key = f"{parent_key}.{key}" if parent_key else key
-                # ページ情報を引き継いで再帰呼び出し
-                clips.extend(convert_to_clips_format_recursive(value, current_parent_key, current_page))
-
-    elif isinstance(data, list):
-        # --- tax_breakdown リストの特別処理 ---
-        if parent_key == "amount_info.tax_breakdown": # ★ parent_key の条件を修正
-            for item in data:
-                item_page = item.get("page", page) if isinstance(item, dict) else page
-                if isinstance(item, dict) and "tax_rate" in item:
-                    tax_rate_data = item.get("tax_rate")
-                    tax_rate = None
-                    if isinstance(tax_rate_data, dict) and "value" in tax_rate_data:
-                        try:
-                            tax_rate = float(tax_rate_data["value"])
-                        except (ValueError, TypeError):
-                            logger.warning(f"Could not parse tax_rate value: {tax_rate_data.get('value')}")
-                    elif isinstance(tax_rate_data, (int, float, str)):
-                        try:
-                            tax_rate = float(tax_rate_data)
-                        except (ValueError, TypeError):
-                            logger.warning(f"Could not parse tax_rate value: {tax_rate_data}")
-
-                    rate_suffix = ""
-                    if tax_rate is not None:
-                        if abs(tax_rate - 0.1) < 1e-9:
-                            rate_suffix = "_for_10_percent"
-                        elif abs(tax_rate - 0.08) < 1e-9:
-                            rate_suffix = "_for_8_percent"
-                        elif abs(tax_rate - 0.0) < 1e-9:
-                            rate_suffix = "_for_0_percent"
-
-                    if rate_suffix:
-                        # Handle taxable_amount (preferring amount_include_tax)
-                        if "amount_include_tax" in item and \
-                           isinstance(item.get("amount_include_tax"), dict) and \
-                           "value" in item["amount_include_tax"] and \
-                           "bbox" in item["amount_include_tax"]:
-                            clip = create_clip_item(
-                                field_name=f"taxable_amount{rate_suffix}",
-                                value=item["amount_include_tax"].get("value"),
-                                bbox=item["amount_include_tax"].get("bbox"),
-                                confidence=item["amount_include_tax"].get("confidence"),
-                                page=item_page
-                            )
-                            if clip:
-                                clips.append(clip)
-                        elif "taxable_amount" in item and \
-                             isinstance(item.get("taxable_amount"), dict) and \
-                             "value" in item["taxable_amount"] and \
-                             "bbox" in item["taxable_amount"]: # Fallback to taxable_amount
-                            clip = create_clip_item(
-                                field_name=f"taxable_amount{rate_suffix}",
-                                value=item["taxable_amount"].get("value"),
-                                bbox=item["taxable_amount"].get("bbox"),
-                                confidence=item["taxable_amount"].get("confidence"),
-                                page=item_page
-                            )
-                            if clip:
-                                clips.append(clip)
-
-                        # Handle amount_consumption_tax and amount_exclude_tax
-                        tax_item_field_map = {
-                            "amount_consumption_tax": "tax_amount",
-                            "amount_exclude_tax": "amount_without_tax"
-                        }
-                        for source_field, target_base_field in tax_item_field_map.items():
-                            if source_field in item and \
-                               isinstance(item.get(source_field), dict) and \
-                               "value" in item[source_field] and \
-                               "bbox" in item[source_field]:
-                                clip = create_clip_item(
-                                    field_name=f"{target_base_field}{rate_suffix}",
-                                    value=item[source_field].get("value"),
-                                    bbox=item[source_field].get("bbox"),
-                                    confidence=item[source_field].get("confidence"),
-                                    page=item_page
-                                )
-                                if clip:
-                                    clips.append(clip)
-                    else:
-                        logger.debug(f"Tax rate ({tax_rate}) does not match 10%, 8%, or 0%. Skipping specific tax field mapping for item: {item}")
-                        # 必要であれば、ここで item 内の他のフィールドを汎用クリップとして処理するロジックを追加
-                        # clips.extend(convert_to_clips_format_recursive(item, parent_key, item_page))
-
-                else: # tax_rate がない、または item が辞書でない場合
-                    clips.extend(convert_to_clips_format_recursive(item, parent_key, item_page))
-        else: # tax_breakdown 以外のリスト
-            for index, item in enumerate(data):
-                # リスト内の要素を再帰的に処理。親キーとページ情報を引き継ぐ
-                item_page = item.get("page", page) if isinstance(item, dict) else page
-                clips.extend(convert_to_clips_format_recursive(item, parent_key, item_page))
+    bank_seen = set() # 出力済みの bank クリップの (x, y, width, height, page)
+    # (要素, 親キー, ページ, 要素の種類) のスタック
+    stack = [(data, parent_key, page, _BANK_NODE if parent_key.startswith(_BANK_DETAILS_KEY) else _NODE)]
+    # ループ内で毎回属性を引かないよう、メソッドをローカル変数に束縛しておく
+    pop = stack.pop
+    push_all = stack.extend
+    append_clip = clips.append
+
+    while stack:
+        node, parent_key, page, kind = pop()
+        # corrected_data は JSON から生成されるため、dict・list のサブクラスは考慮せず型を直接比較する
+        node_type = type(node)
+
+        if kind == _TAX_ITEM:
+            _append_tax_breakdown_item_clips(node, page, clips)
+
+        elif kind == _BANK_NODE:
+            # --- bank_details 配下の特別処理 ---
+            # クリップ対象は親キーが bank_details そのものの要素のみのため、それより深い要素は探索しない
+            if parent_key != _BANK_DETAILS_KEY:
+                continue
+            if node_type is dict:
+                clip = _bank_details_clip(node, parent_key, node.get("page", page))
+                if clip and not _is_duplicate_bank_clip(clip, bank_seen):
+                    append_clip(clip)
+            elif node_type is list:
+                children = [
+                    (item, parent_key, item.get("page", page) if type(item) is dict else page, _BANK_NODE)
+                    for item in node
+                ]
+                push_all(reversed(children))
+
+        elif node_type is dict:
+            # ページ情報を抽出 (存在すれば)
+            current_page = node.get("page", page)
+            clip = _field_clip(node, parent_key, current_page)
+            if clip and not _is_duplicate_bank_clip(clip, bank_seen):
+                append_clip(clip)
+
+            # valueやbbox以外のキーも探索 (ページ情報を引き継ぐ)
+            # クリップを生成しないスカラー値の子要素は、キー文字列を組み立てずにここで除外する
+            # 親キーが空でなければ子要素のキーが bank_details で始まることはないため、トップレベルのキーのみ判定する
+            children = [
+                (value, f"{parent_key}.{key}", current_page, _NODE) if parent_key else
+                (value, key, current_page, _BANK_NODE if key.startswith(_BANK_DETAILS_KEY) else _NODE)
+                for key, value in node.items() if key not in _NON_CHILD_KEYS and type(value) in _CONTAINER_TYPES
+            ]
+            push_all(reversed(children))
+
+        elif node_type is list:
+            # リスト内の要素を処理。親キーとページ情報を引き継ぐ
+            # --- tax_breakdown リストの特別処理 ---
+            # tax_rate を持つ要素は税率ごとのフィールド名でクリップし、それ以外は通常どおり探索する
+            is_tax_breakdown = parent_key == _TAX_BREAKDOWN_KEY
+            children = [
+                (item, parent_key, item.get("page", page) if type(item) is dict else page,
+                 _TAX_ITEM if is_tax_breakdown and type(item) is dict and "tax_rate" in item else _NODE)
+                for item in node
+            ]
+            push_all(reversed(children))
 
     return clips
 
+def _has_any_bbox(data: Any) -> bool:
+    """
+    データ内に None でない 'bbox' を持つ辞書要素が1つでも存在するかを判定する。
+    クリップは bbox を持つ要素からのみ生成されるため、存在しなければクリップの生成を省略できる。
+    最初に見つかった時点で探索を打ち切る。
+    """
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        node_type = type(node)
+        if node_type is dict:
+            if node.get("bbox") is not None:
+                return True
+            stack.extend(value for value in node.values() if type(value) in _CONTAINER_TYPES)
+        elif node_type is list:
+            stack.extend(item for item in node if type(item) in _CONTAINER_TYPES)
+    return False
+
+# すべて0の bbox (x, y, width, height)
+_ZERO_BBOX = (0.0, 0.0, 0.0, 0.0)
+
+def _clip_box(clip: Dict[str, Any]) -> Optional[tuple]:
+    """
+    内部形式のクリップから (x, y, width, height) を求める。bbox が不正または存在しない場合は None を返す。
+    """
+    raw_bbox = clip.get("_bbox")
+    if raw_bbox is not None:
+        # create_clip_item に渡した bbox をそのまま使う (4点の座標から min/max を求め直さない)
+        x, y, width, height = raw_bbox
+        x_min, y_min, x_max, y_max = x, y, x + width, y + height
+    else:
+        # position.bounding_box から x, y, width, height を抽出
+        box_points = clip.get("position", {}).get("bounding_box")
+        if box_points is None or len(box_points) != 4:
+            return None
+        # x, y は左上の座標 (min x, min y)
+        x_min = min(p.get('x', float('inf')) for p in box_points)
+        y_min = min(p.get('y', float('inf')) for p in box_points)
+        x_max = max(p.get('x', float('-inf')) for p in box_points)
+        y_max = max(p.get('y', float('-inf')) for p in box_points)
+
+    # 有効な座標かチェック
+    if math.isinf(x_min) or math.isinf(y_min) or math.isinf(x_max) or math.isinf(y_max):
+        return None
+    width = x_max - x_min
+    height = y_max - y_min
+    # 幅と高さが非負であることも確認
+    if not (width >= 0 and height >= 0):
+        return None
+    return (x_min, y_min, width, height)
 
 def format_sqs_message(processed_data: Dict[str, Any], clipping_request_id: str, s3_key: str) -> Dict[str, Any]:
     """
@@ -247,79 +393,36 @@ def format_sqs_message(processed_data: Dict[str, Any], clipping_request_id: str,
             # 内部形式のクリップリストを生成 (ページ情報は corrected_data のトップレベルにある想定)
             # TODO: ページ情報がどこから来るか確認・調整が必要
             initial_page = corrected_data.get("page", 1) if isinstance(corrected_data, dict) else 1
-            internal_clips = convert_to_clips_format_recursive(corrected_data, page=initial_page)
+            # bbox がどこにも存在しない場合 (OCRの結果が部分的な場合など) は探索を省略する
+            internal_clips = convert_to_clips_format_recursive(corrected_data, page=initial_page) if _has_any_bbox(corrected_data) else []
 
             if internal_clips:
                 # 内部形式から要求仕様の形式に変換
                 formatted_clips = []
-                processed_bank_bboxes = set() # 同じbboxを持つbankクリップをまとめるためのセット
+                append_formatted = formatted_clips.append
 
                 for clip in internal_clips:
-                    bbox_data = None
-                    # position.bounding_box から x, y, width, height を抽出
-                    if "position" in clip and "bounding_box" in clip["position"]:
-                        box_points = clip["position"]["bounding_box"]
-                        if len(box_points) == 4:
-                            # x, y は左上の座標 (min x, min y)
-                            x_min = min(p.get('x', float('inf')) for p in box_points)
-                            y_min = min(p.get('y', float('inf')) for p in box_points)
-                            x_max = max(p.get('x', float('-inf')) for p in box_points)
-                            y_max = max(p.get('y', float('-inf')) for p in box_points)
-                            # 有効な座標かチェック
-                            if all(v not in [float('inf'), float('-inf')] for v in [x_min, y_min, x_max, y_max]):
-                                width = x_max - x_min
-                                height = y_max - y_min
-                                # 幅と高さが非負であることも確認
-                                if width >= 0 and height >= 0:
-                                    bbox_data = {
-                                        "x_coordinate": x_min,
-                                        "y_coordinate": y_min,
-                                        "width": width,
-                                        "height": height,
-                                    }
-
-                    if bbox_data:
-                        # Bbox の値がすべて0の場合はスキップ
-                        if bbox_data["x_coordinate"] == 0.0 and \
-                           bbox_data["y_coordinate"] == 0.0 and \
-                           bbox_data["width"] == 0.0 and \
-                           bbox_data["height"] == 0.0:
-                            logger.info(f"Skipping clip for field '{clip.get('field_name')}' because its bbox is all zeros.")
-                        else:
-                            # --- bank フィールドの重複排除ロジック ---
-                            # field_name が 'bank' の場合、同じ bbox のクリップが既に追加されていないか確認
-                            is_duplicate_bank = False
-                            if clip.get("field_name") == "bank":
-                                # bbox情報をタプルに変換してセットで管理
-                                bbox_tuple = (
-                                    bbox_data["x_coordinate"],
-                                    bbox_data["y_coordinate"],
-                                    bbox_data["width"],
-                                    bbox_data["height"],
-                                    clip.get("page", 0) # ページも考慮
-                                )
-                                if bbox_tuple in processed_bank_bboxes:
-                                    is_duplicate_bank = True
-                                    logger.debug(f"Skipping duplicate bank clip for bbox: {bbox_tuple}")
-                                else:
-                                    processed_bank_bboxes.add(bbox_tuple)
-
-                            if not is_duplicate_bank:
-                                formatted_clip = {
-                                    "field_name": clip.get("field_name"),
-                                    # "value": clip.get("value"), # value は内部処理用なので、SQSメッセージには含めない
-                                    "x_coordinate": bbox_data["x_coordinate"],
-                                    "y_coordinate": bbox_data["y_coordinate"],
-                                    "width": bbox_data["width"],
-                                    "height": bbox_data["height"],
-                                    "page": clip.get("page", 1), # 内部クリップからページ情報を取得
-                                    "reliability_score": clip.get("confidence", 1) # confidence を reliability_score にマッピング
-                                }
-
-                                formatted_clips.append(formatted_clip)
-                    else:
-                        logger.warning(f"Could not format clip due to invalid or missing bbox for field '{clip.get('field_name')}': {clip.get('position')}")
-
+                    box = _clip_box(clip)
+                    if box is None:
+                        logger.warning("Could not format clip due to invalid or missing bbox for field '%s': %s", clip.get('field_name'), clip.get('position'))
+                        continue
+
+                    # Bbox の値がすべて0の場合はスキップ
+                    if box == _ZERO_BBOX:
+                        logger.info("Skipping clip for field '%s' because its bbox is all zeros.", clip.get('field_name'))
+                        continue
+
+                    x_min, y_min, width, height = box
+                    append_formatted({
+                        "field_name": clip.get("field_name"),
+                        # "value": clip.get("value"), # value は内部処理用なので、SQSメッセージには含めない
+                        "x_coordinate": x_min,
+                        "y_coordinate": y_min,
+                        "width": width,
+                        "height": height,
+                        "page": clip.get("page", 1), # 内部クリップからページ情報を取得
+                        "reliability_score": clip.get("confidence", 1) # confidence を reliability_score にマッピング
+                    })
 
                 if formatted_clips:
                     final_message["clips"] = formatted_clips
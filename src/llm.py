@@ -1,14 +1,33 @@
 import os
+import re
 import json
-import vertexai
+import hashlib
+import threading
+import orjson
 from datetime import datetime
 from pathlib import Path
-from vertexai.preview.generative_models import GenerativeModel
 from src.utils.logger import setup_logger
 from src.utils.helper import get_prompt_template
+from src.utils.cache import LRUCache
 
 logger = setup_logger()
 
+# Vertex AI SDKはインポートに時間がかかるため、初回の利用時に読み込む (コールドスタート短縮)
+vertexai = None
+GenerativeModel = None
+
+def _import_vertexai():
+    """
+    Vertex AI SDKを必要になった時点でインポートする
+    """
+    global vertexai, GenerativeModel
+    if vertexai is None:
+        import vertexai as vertexai_module
+        vertexai = vertexai_module
+    if GenerativeModel is None:
+        from vertexai.preview.generative_models import GenerativeModel as generative_model_class
+        GenerativeModel = generative_model_class
+
 # 使用するモデルを設定
 MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
 LOCATION = os.environ.get("GOOGLE_CLOUD_REGION", "us-central1")
@@ -16,6 +35,101 @@ LOCATION = os.environ.get("GOOGLE_CLOUD_REGION", "us-central1")
 # 認証情報ファイルのパスを設定（環境変数、またはデフォルトパス）
 CREDENTIALS_PATH = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "./credential.json")
 
+# vertexai.init() はプロセス内で一度だけ実行する (初期化済みのリージョンを保持)
+_vertexai_initialized_location = None
+_vertexai_init_lock = threading.Lock()
+
+def _init_vertexai():
+    """
+    Vertex AIを初期化する。ウォームスタート時は初期化済みの設定を再利用する。
+    """
+    global _vertexai_initialized_location
+    if _vertexai_initialized_location == LOCATION:
+        return
+    with _vertexai_init_lock:
+        if _vertexai_initialized_location != LOCATION:
+            vertexai.init(location=LOCATION)
+            _vertexai_initialized_location = LOCATION
+
+# モデル設定
+GENERATION_CONFIG = {
+    "temperature": 0,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json",
+}
+
+# Geminiモデルはプロセス内で共有する
+# モデルごとに作成されるgRPCチャネル (HTTP/2) を使い回し、呼び出しのたびのTLSハンドシェイクを避ける
+_generative_model = None
+_generative_model_lock = threading.Lock()
+
+def _get_generative_model():
+    """
+    プロセス内で共有するGeminiモデルを取得する。未作成の場合はシステムプロンプトを読み込んで作成する。
+    """
+    global _generative_model
+    if _generative_model is None:
+        with _generative_model_lock:
+            if _generative_model is None:
+                _generative_model = GenerativeModel(
+                    model_name=MODEL,
+                    generation_config=GENERATION_CONFIG,
+                    system_instruction=get_prompt_template('system'),
+                )
+    return _generative_model
+
+# Geminiの応答をキャッシュする件数 (0で無効)。同じOCRテキストでの再試行時にLLMの呼び出しを省略する
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", "32"))
+
+# (モデル名, プロンプトのハッシュ) をキーとした、JSONとしてパースできた応答のキャッシュ (ウォームスタート間で共有)
+_llm_response_cache = LRUCache(LLM_CACHE_SIZE)
+
+def _llm_cache_key(prompt):
+    """
+    プロンプトからGeminiの応答のキャッシュキーを作成する (モデルを変更した場合はキャッシュを使わない)
+    """
+    return (MODEL, hashlib.blake2b(prompt.encode(), digest_size=16).digest())
+
+# ユーザープロンプトのテンプレートもプロセス内で一度だけ読み込む
+_user_prompt_template = None
+
+def _get_user_prompt_template():
+    """
+    プロセス内で共有するユーザープロンプトのテンプレートを取得する。未読み込みの場合はファイルから読み込む。
+    """
+    global _user_prompt_template
+    if _user_prompt_template is None:
+        _user_prompt_template = get_prompt_template('user')
+    return _user_prompt_template
+
+def prewarm_generative_model():
+    """
+    Vertex AI SDKの読み込み・初期化とGeminiモデルの作成を先に済ませておく (Lambdaの初期化フェーズでの呼び出しを想定)
+    """
+    _import_vertexai()
+    _init_vertexai()
+    _get_generative_model()
+    _get_user_prompt_template()
+
+# LLMの応答でよく発生するJSONエラーのパターン (呼び出しのたびにコンパイルしないようモジュール読み込み時にコンパイルする)
+# パターン1: 配列内のオブジェクトの最後でカンマが不足している ("}\n      }\n    ]," の前にカンマを追加)
+_MISSING_COMMA_PATTERN = re.compile(r'(\n\s*})\n(\s*})\n(\s*],)')
+# パターン2: 最後のオブジェクトの後に余分なカンマがある
+_TRAILING_COMMA_PATTERN = re.compile(r',(\s*}])')
+
+def _loads_json(text):
+    """
+    LLMの応答のJSONをパースする。高速なorjsonでパースし、失敗した場合は標準のjsonで再試行する
+    (orjsonが受け付けない NaN・Infinity や64ビットを超える整数も、従来どおりパースできるようにする)
+
+    Raises:
+        json.JSONDecodeError: JSONとしてパースできない場合
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
 def fix_common_json_errors(json_text: str) -> str:
     """
     LLMの応答でよく発生するJSONエラーを自動修正する
@@ -28,22 +142,8 @@ def fix_common_json_errors(json_text: str) -> str:
     """
     try:
         # 一般的なJSONエラーパターンを修正
-        fixed_text = json_text
-        
-        # パターン1: オブジェクトの後にカンマが不足している場合
-        # "}\n      }\n    ]," のパターンを "}\n      }\n    ]," に修正
-        import re
-        
-        # 配列内のオブジェクトの最後でカンマが不足しているパターンを修正
-        # "}\n      }\n    ]," の前にカンマを追加
-        pattern1 = r'(\n\s*})\n(\s*})\n(\s*],)'
-        replacement1 = r'\1,\n\2\n\3'
-        fixed_text = re.sub(pattern1, replacement1, fixed_text)
-        
-        # パターン2: 最後のオブジェクトの後に余分なカンマがある場合を削除
-        pattern2 = r',(\s*}])'
-        replacement2 = r'\1'
-        fixed_text = re.sub(pattern2, replacement2, fixed_text)
+        fixed_text = _MISSING_COMMA_PATTERN.sub(r'\1,\n\2\n\3', json_text)
+        fixed_text = _TRAILING_COMMA_PATTERN.sub(r'\1', fixed_text)
         
         return fixed_text.strip()
         
@@ -64,30 +164,33 @@ def extract_information(text):
     logger.info(f"Extracting information using Gemini LLM with Vertex AI (Model: {MODEL})")
     
     try:
-        # Vertex AIの初期化
-        vertexai.init(location=LOCATION)
+        # Vertex AIの初期化 (初回のみ)
+        _import_vertexai()
+        _init_vertexai()
         
-        # システムプロンプトとユーザープロンプトを取得
-        system_prompt = get_prompt_template('system')
-        user_prompt_template = get_prompt_template('user')
-        
-        # ユーザープロンプトの構築
+        # Geminiモデルの取得 (初回のみシステムプロンプトを読み込んで作成)
+        model = _get_generative_model()
+
+        # ユーザープロンプトを取得して構築 (テンプレートは初回のみ読み込む)
+        user_prompt_template = _get_user_prompt_template()
         prompt = user_prompt_template.format(text=text)
 
-        # モデル設定
-        generation_config = {
-            "temperature": 0,
-            "max_output_tokens": 8192,
-            "response_mime_type": "application/json",
-        }
-        
-        # Geminiモデルの初期化
-        model = GenerativeModel(
-            model_name=MODEL,
-            generation_config=generation_config,
-            system_instruction=system_prompt,
-        )
-        
+        # 同じプロンプトの応答がキャッシュされていればLLMを呼び出さない (再試行時など)
+        cache_key = _llm_cache_key(prompt)
+        cached = _llm_response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Using cached Gemini response for an identical prompt")
+            extracted_info = _loads_json(cached)
+            # LLMを呼び出していないため、トークン使用量は0とし、キャッシュした応答であることを記録する
+            # (使用量を集計した際に再試行分を二重に数えないようにする)
+            extracted_info['usage_metadata'] = {
+                'prompt_token_count': 0,
+                'candidates_token_count': 0,
+                'total_token_count': 0,
+                'cached': True
+            }
+            return extracted_info
+
         response = model.generate_content(prompt)
         
         # レスポンスからテキストを取得
@@ -102,7 +205,7 @@ def extract_information(text):
 
         # JSON形式のレスポンスをパース
         try:
-            extracted_info = json.loads(result)
+            extracted_info = _loads_json(result)
             # 抽出結果にトークン情報を追加
             extracted_info['usage_metadata'] = {
                 'prompt_token_count': prompt_tokens,
@@ -110,6 +213,7 @@ def extract_information(text):
                 'total_token_count': total_tokens
             }
             logger.info("Successfully extracted information using Gemini LLM via Vertex AI")
+            _llm_response_cache.put(cache_key, result)
             return extracted_info
         except json.JSONDecodeError as json_error:
             # JSONとしてパースできない場合は、自動修正を試行
@@ -120,7 +224,7 @@ def extract_information(text):
             
             try:
                 # 修正後のJSONでパースを再試行
-                extracted_info = json.loads(fixed_result)
+                extracted_info = _loads_json(fixed_result)
                 logger.info("Successfully parsed JSON after auto-correction")
                 
                 # 抽出結果にトークン情報を追加
@@ -129,6 +233,7 @@ def extract_information(text):
                     'candidates_token_count': candidates_tokens,
                     'total_token_count': total_tokens
                 }
+                _llm_response_cache.put(cache_key, fixed_result)
                 return extracted_info
                 
             except json.JSONDecodeError as second_json_error:
@@ -148,4 +253,70 @@ def extract_information(text):
             
     except Exception as e:
         logger.error(f"Error extracting information using Gemini LLM via Vertex AI: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+# 複数の書類をまとめて抽出する場合にユーザープロンプトの後に付加する指示
+BATCH_PROMPT_INSTRUCTION = """
+上記には{count}件の書類が <doc id="..."> ～ </doc> で区切られて含まれています。
+書類ごとに個別に情報を抽出し、書類のidをキー、その書類の抽出結果を値とするJSONオブジェクトで返してください。
+例: {{"0": {{...}}, "1": {{...}}}}
+"""
+
+def extract_information_batch(texts):
+    """
+    複数の書類のOCRデータを1回のプロンプトでLLMに送信し、書類ごとの情報を抽出する
+
+    Args:
+        texts (list): 書類ごとのOCRデータのリスト
+
+    Returns:
+        list[dict]: textsと同じ順序の抽出結果のリスト。
+            応答に含まれなかった書類は extract_information で個別に抽出する。
+    """
+    if len(texts) == 1:
+        return [extract_information(texts[0])]
+
+    logger.info(f"Extracting information for {len(texts)} documents in one request (Model: {MODEL})")
+
+    _import_vertexai()
+    _init_vertexai()
+    model = _get_generative_model()
+
+    user_prompt_template = _get_user_prompt_template()
+    documents = "\n".join(f'<doc id="{i}">\n{text}\n</doc>' for i, text in enumerate(texts))
+    prompt = user_prompt_template.format(text=documents) + BATCH_PROMPT_INSTRUCTION.format(count=len(texts))
+
+    response = model.generate_content(prompt)
+    result = response.text
+    usage_metadata = response.usage_metadata
+    # トークン数は複数書類の合計のため、書類ごとの使用量 (prompt_token_count等) とは別のキーで書類数とともに記録する
+    # (書類ごとに合計すると、バッチの使用量が書類数の分だけ重複して数えられるため)
+    usage = {
+        'batch_prompt_token_count': usage_metadata.prompt_token_count,
+        'batch_candidates_token_count': usage_metadata.candidates_token_count,
+        'batch_total_token_count': usage_metadata.total_token_count,
+        'batch_size': len(texts),
+    }
+    logger.info(f"Gemini Token Usage (batch of {len(texts)}): Prompt={usage['batch_prompt_token_count']}, "
+                f"Candidates={usage['batch_candidates_token_count']}, Total={usage['batch_total_token_count']}")
+
+    try:
+        parsed = _loads_json(result)
+    except json.JSONDecodeError:
+        try:
+            parsed = _loads_json(fix_common_json_errors(result))
+        except json.JSONDecodeError as json_error:
+            logger.warning(f"Failed to parse batched LLM response, extracting documents individually: {str(json_error)}")
+            parsed = {}
+
+    results = []
+    for i, text in enumerate(texts):
+        extracted_info = parsed.get(str(i)) if isinstance(parsed, dict) else None
+        if isinstance(extracted_info, dict):
+            # 結果ごとに別の辞書にする (1件の変更が他の書類の結果に影響しないようにする)
+            extracted_info['usage_metadata'] = dict(usage)
+        else:
+            logger.warning(f"Document {i} was missing from the batched LLM response, extracting it individually")
+            extracted_info = extract_information(text)
+        results.append(extracted_info)
+    return results
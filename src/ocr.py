@@ -1,11 +1,43 @@
 import os
-from google.cloud import vision
-import io
-import fitz  # PyMuPDF
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
 from src.utils.logger import setup_logger
+from src.utils.clients import get_s3_client, get_vision_client
 
 logger = setup_logger()
 
+# batch_annotate_imagesの1リクエストあたりの画像数上限 (Vision APIの制限)
+VISION_BATCH_MAX_IMAGES = 16
+# batch_annotate_imagesの1リクエストあたりの画像サイズ合計の上限 (リクエストサイズ制限に余裕を持たせる)
+VISION_BATCH_MAX_BYTES = 8 * 1024 * 1024
+# 画像が1リクエストに収まらない場合に、並行して送信するbatch_annotate_imagesのリクエスト数の上限
+VISION_BATCH_CONCURRENCY = int(os.environ.get("VISION_BATCH_CONCURRENCY", "4"))
+
+# PDFのページを変換する画像形式 ("png" または "jpeg")
+# テキスト主体のPDFではPNGの方がエンコードが速くサイズも小さいが、スキャンしたPDF (ノイズの多い画像) ではJPEGの方が小さくなる
+PDF_PAGE_IMAGE_FORMAT = os.environ.get("PDF_PAGE_IMAGE_FORMAT", "png").lower()
+# PDF_PAGE_IMAGE_FORMAT が "jpeg" の場合の画質 (OCRの精度を落とさないよう高めにする)
+PDF_PAGE_JPEG_QUALITY = int(os.environ.get("PDF_PAGE_JPEG_QUALITY", "90"))
+# PDFのページをグレースケールで変換するか (RGBに比べて変換が速く、画像も小さくなる)
+# OCRに送信する画像が変わるため、精度への影響を確認するまではデフォルトでは無効にする
+PDF_PAGE_GRAYSCALE = os.environ.get("PDF_PAGE_GRAYSCALE", "false").lower() == "true"
+# PDFのページを変換した画像の長辺の上限 (ピクセル)。大きな用紙のページはこの大きさに収まるよう解像度を下げる (0で無効)
+# 制限するとOCRの座標 (クリップの座標) が150DPIの画素座標でなくなるため、デフォルトでは無効にする
+PDF_PAGE_MAX_DIMENSION = int(os.environ.get("PDF_PAGE_MAX_DIMENSION", "0"))
+
+# PyMuPDFはスレッドセーフではないため、PDFの変換は1つずつ行う
+# (複数のレコードのOCRがスレッドで並行して実行されるため。Vision APIの呼び出しはロックの外で並行して行う)
+_pdf_render_lock = threading.Lock()
+
+# OCR結果を画像の内容 (SHA-256) をキーとして保存するS3バケット (空の場合は無効)
+# 同じ画像・PDFが再送された場合に、Vision APIの呼び出しを省略する
+OCR_RESULT_CACHE_BUCKET = os.environ.get("OCR_RESULT_CACHE_BUCKET", "")
+# OCR結果のキャッシュのキーのプレフィックス (リクエストする機能ごとに分け、機能を変えた場合に古い結果を使わないようにする)
+OCR_RESULT_CACHE_PREFIX = "ocr-cache/document_text_detection/"
+
 def extract_text(file_path):
     """
     Google Cloud Visionを使用して画像またはPDFからOCR結果を取得する
@@ -21,12 +53,214 @@ def extract_text(file_path):
     """
     logger.info(f"Extracting text data from file: {file_path}")
 
-    file_extension = os.path.splitext(file_path)[1].lower()
+    content = Path(file_path).read_bytes()
+
+    return extract_text_from_bytes(content, file_path)
+
+def extract_text_from_bytes(content, file_name):
+    """
+    Google Cloud Visionを使用して、メモリ上の画像またはPDFからOCR結果を取得する
+
+    Args:
+        content (bytes): ファイルの内容
+        file_name (str): ファイル名またはS3オブジェクトキー (拡張子による種別判定とログに使用)
+
+    Returns:
+        extract_textと同じ
+    """
+    file_extension = os.path.splitext(file_name)[1].lower()
 
     if file_extension == '.pdf':
-        return extract_ocr_data_from_pdf(file_path)
+        return extract_ocr_data_from_pdf_bytes(content, file_name)
     else:
-        return extract_ocr_data_from_image(file_path)
+        return extract_ocr_data_from_image_bytes(content, file_name)
+
+def extract_text_batch(files):
+    """
+    複数の画像/PDFからまとめてOCR結果を取得する
+    画像とPDFの各ページ (画像に変換したもの) をbatch_annotate_imagesで最大16件ずつ1回のリクエストにまとめる
+
+    Args:
+        files (list[tuple[bytes, str]]): (ファイルの内容, ファイル名またはS3オブジェクトキー) のリスト
+
+    Returns:
+        list: filesと同じ順序で、extract_textと同じ形式の結果を格納したリスト
+    """
+    results = [None] * len(files)
+    # リクエストにまとめる画像: (画像の内容, ログ用の名前, filesのインデックス, PDFのページかどうか)
+    items = []
+
+    for i, (content, file_name) in enumerate(files):
+        if os.path.splitext(file_name)[1].lower() == '.pdf':
+            results[i] = []
+            try:
+                pages = _render_pdf_pages(content, file_name)
+            except Exception as e:
+                logger.error(f"Error extracting OCR data from PDF {file_name}: {str(e)}")
+                raise
+            items.extend((page, f"{file_name} page {page_num+1}", i, True) for page_num, page in enumerate(pages))
+        else:
+            items.append((content, file_name, i, False))
+
+    for (_, name, i, is_pdf_page), response in zip(items, _annotate_in_batches([item[0] for item in items])):
+        if response.error.message:
+            logger.error(f"Vision API error for {name}: {response.error.message}")
+            # PDFのページ単位のエラーは、そのページを除いて処理を続ける (extract_ocr_data_from_pdfと同じ)
+            if is_pdf_page:
+                continue
+            raise Exception(
+                '{}\nFor more info on error messages, check: '
+                'https://cloud.google.com/apis/design/errors'.format(
+                    response.error.message))
+
+        if response.full_text_annotation:
+            logger.info(f"Successfully extracted OCR data from: {name}")
+            if is_pdf_page:
+                results[i].append(response)
+            else:
+                results[i] = response
+        else:
+            logger.warning(f"No text found in: {name}")
+
+    return results
+
+def _build_image_batches(sized_indices):
+    """
+    (インデックス, バイト数) のリストを、件数とサイズ合計の上限を超えないバッチに分割する
+
+    Returns:
+        list[list[int]]: インデックスのバッチのリスト
+    """
+    batches = []
+    current_batch = []
+    current_bytes = 0
+
+    for index, size in sized_indices:
+        if current_batch and (len(current_batch) >= VISION_BATCH_MAX_IMAGES or current_bytes + size > VISION_BATCH_MAX_BYTES):
+            batches.append(current_batch)
+            current_batch = []
+            current_bytes = 0
+        current_batch.append(index)
+        current_bytes += size
+
+    if current_batch:
+        batches.append(current_batch)
+
+    return batches
+
+def _annotate_in_batches(contents):
+    """
+    複数画像を件数・サイズの上限ごとのbatch_annotate_imagesのリクエストに分割してOCRする
+    リクエストが複数になる場合は、ネットワークの待ち時間が重なるようスレッドで並行して送信する
+
+    Args:
+        contents (list[bytes]): 画像の内容のリスト
+
+    Returns:
+        list[google.cloud.vision.AnnotateImageResponse]: contentsと同じ順序のレスポンスのリスト
+    """
+    if not OCR_RESULT_CACHE_BUCKET or not contents:
+        return _annotate_uncached(contents)
+
+    # S3に保存済みのOCR結果があれば使い、ない画像だけをVision APIに送信する
+    cache_keys = [_ocr_result_cache_key(content) for content in contents]
+    with ThreadPoolExecutor(max_workers=min(len(contents), VISION_BATCH_CONCURRENCY)) as executor:
+        responses = list(executor.map(_load_cached_response, cache_keys))
+    missing = [k for k, response in enumerate(responses) if response is None]
+    if len(missing) < len(contents):
+        logger.info(f"Reusing cached OCR results for {len(contents) - len(missing)} of {len(contents)} image(s)")
+    if not missing:
+        return responses
+
+    new_responses = _annotate_uncached([contents[k] for k in missing])
+    for k, response in zip(missing, new_responses):
+        responses[k] = response
+    # エラーのレスポンスは一時的なものの可能性があるため保存しない
+    stored = [(cache_keys[k], response) for k, response in zip(missing, new_responses) if not response.error.message]
+    if stored:
+        with ThreadPoolExecutor(max_workers=min(len(stored), VISION_BATCH_CONCURRENCY)) as executor:
+            list(executor.map(lambda item: _store_cached_response(*item), stored))
+    return responses
+
+def _annotate_uncached(contents):
+    """
+    キャッシュを使わずに、複数画像をbatch_annotate_imagesのリクエストに分割してOCRする (_annotate_in_batchesを参照)
+    """
+    batches = [[contents[k] for k in batch] for batch in _build_image_batches([(k, len(content)) for k, content in enumerate(contents)])]
+    if len(batches) <= 1:
+        return _batch_annotate_images(batches[0]) if batches else []
+
+    # バッチは先頭から順に分割されているため、バッチの順にレスポンスを連結すればcontentsと同じ順序になる
+    with ThreadPoolExecutor(max_workers=min(len(batches), VISION_BATCH_CONCURRENCY)) as executor:
+        return [response for responses in executor.map(_batch_annotate_images, batches) for response in responses]
+
+def _ocr_result_cache_key(content):
+    """
+    画像の内容のハッシュ (SHA-256) からOCR結果のキャッシュのS3オブジェクトキーを作成する
+    """
+    return f"{OCR_RESULT_CACHE_PREFIX}{hashlib.sha256(content).hexdigest()}.pb"
+
+# OCR結果のキャッシュの読み込みで、保存されていないことを示すS3のエラーコード
+_CACHE_MISS_ERROR_CODES = ("NoSuchKey", "404", "AccessDenied", "403")
+
+def _load_cached_response(cache_key):
+    """
+    S3に保存済みのOCR結果を読み込む
+
+    Returns:
+        google.cloud.vision.AnnotateImageResponse | None: 保存されていない、または読み込みに失敗した場合はNone
+    """
+    from google.cloud import vision
+
+    try:
+        body = get_s3_client().get_object(Bucket=OCR_RESULT_CACHE_BUCKET, Key=cache_key)["Body"].read()
+        return vision.AnnotateImageResponse.deserialize(body)
+    except ClientError as e:
+        # s3:ListBucket権限がない場合、存在しないキーはNoSuchKeyではなくAccessDeniedになるため、これもキャッシュミスとして扱う
+        if e.response.get("Error", {}).get("Code") in _CACHE_MISS_ERROR_CODES:
+            logger.debug(f"OCR result is not cached: s3://{OCR_RESULT_CACHE_BUCKET}/{cache_key}")
+            return None
+        logger.warning(f"Failed to load cached OCR result s3://{OCR_RESULT_CACHE_BUCKET}/{cache_key}: {e}")
+        return None
+    except Exception as e:
+        # キャッシュが使えない場合はVision APIで処理を続ける
+        logger.warning(f"Failed to load cached OCR result s3://{OCR_RESULT_CACHE_BUCKET}/{cache_key}: {e}")
+        return None
+
+def _store_cached_response(cache_key, response):
+    """
+    OCR結果をS3に保存する (失敗してもOCRの結果には影響しないため、警告のみ出力する)
+    """
+    from google.cloud import vision
+
+    try:
+        get_s3_client().put_object(Bucket=OCR_RESULT_CACHE_BUCKET, Key=cache_key,
+                                   Body=vision.AnnotateImageResponse.serialize(response))
+    except Exception as e:
+        logger.warning(f"Failed to store OCR result s3://{OCR_RESULT_CACHE_BUCKET}/{cache_key}: {e}")
+
+def _batch_annotate_images(contents):
+    """
+    batch_annotate_imagesで複数画像のDOCUMENT_TEXT_DETECTIONを1回のリクエストで実行する
+
+    Args:
+        contents (list[bytes]): 画像の内容のリスト
+
+    Returns:
+        list[google.cloud.vision.AnnotateImageResponse]: contentsと同じ順序のレスポンスのリスト
+    """
+    # Vision SDKはインポートに時間がかかるため、利用時に読み込む (コールドスタート短縮)
+    from google.cloud import vision
+
+    client = get_vision_client()
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    requests = [
+        vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature])
+        for content in contents
+    ]
+
+    logger.info(f"Requesting batch document text detection for {len(requests)} image(s)")
+    return list(client.batch_annotate_images(requests=requests).responses)
 
 def extract_ocr_data_from_image(image_path):
     """
@@ -39,16 +273,39 @@ def extract_ocr_data_from_image(image_path):
         google.cloud.vision.AnnotateImageResponse | None:
             Vision APIのレスポンスオブジェクト。テキストが検出されなかった場合はNone。
     """
-    try:
-        client = vision.ImageAnnotatorClient()
+    content = Path(image_path).read_bytes()
+
+    return extract_ocr_data_from_image_bytes(content, image_path)
+
+def extract_ocr_data_from_image_bytes(content, image_path):
+    """
+    Google Cloud Visionを使用して、メモリ上の画像からOCR結果を取得する
+
+    Args:
+        content (bytes): 画像の内容
+        image_path (str): 画像のパスまたはS3オブジェクトキー (ログ出力用)
+
+    Returns:
+        google.cloud.vision.AnnotateImageResponse | None:
+            Vision APIのレスポンスオブジェクト。テキストが検出されなかった場合はNone。
+    """
+    # Vision SDKはインポートに時間がかかるため、利用時に読み込む (コールドスタート短縮)
+    from google.cloud import vision
 
-        with io.open(image_path, 'rb') as image_file:
-            content = image_file.read()
+    try:
+        cache_key = _ocr_result_cache_key(content) if OCR_RESULT_CACHE_BUCKET else None
+        response = _load_cached_response(cache_key) if cache_key else None
+        if response is None:
+            client = get_vision_client()
 
-        image = vision.Image(content=content)
+            image = vision.Image(content=content)
 
-        logger.info(f"Requesting document text detection for image: {image_path}")
-        response = client.document_text_detection(image=image)
+            logger.info(f"Requesting document text detection for image: {image_path}")
+            response = client.document_text_detection(image=image)
+            if cache_key and not response.error.message:
+                _store_cached_response(cache_key, response)
+        else:
+            logger.info(f"Reusing cached OCR result for image: {image_path}")
 
         if response.error.message:
             logger.error(f"Vision API error for {image_path}: {response.error.message}")
@@ -84,32 +341,30 @@ def extract_ocr_data_from_pdf(pdf_path, max_pages=1, dpi=150):
             ページごとのVision APIレスポンスオブジェクトのリスト。
             エラーが発生したページやテキストがないページは含まれない可能性がある。
     """
-    try:
-        client = vision.ImageAnnotatorClient()
-        responses = []
+    content = Path(pdf_path).read_bytes()
 
-        pdf_document = fitz.open(pdf_path)
-        num_pages_to_process = min(len(pdf_document), max_pages)
+    return extract_ocr_data_from_pdf_bytes(content, pdf_path, max_pages=max_pages, dpi=dpi)
 
-        logger.info(f"Processing {num_pages_to_process} page(s) out of {len(pdf_document)} for PDF: {pdf_path} at {dpi} DPI")
-
-        for page_num in range(num_pages_to_process):
-            logger.info(f"Processing PDF page {page_num+1}/{num_pages_to_process}")
+def extract_ocr_data_from_pdf_bytes(content, pdf_path, max_pages=1, dpi=150):
+    """
+    メモリ上のPDFからページごとにOCR結果を取得する
 
-            page = pdf_document.load_page(page_num)
-            
-            # PDFの元の解像度を保持するため、変換マトリックスを計算
-            # 指定されたDPIで画像を生成
-            zoom = dpi / 72  # 72dpiがPyMuPDFのデフォルト
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
+    Args:
+        content (bytes): PDFの内容
+        pdf_path (str): PDFのパスまたはS3オブジェクトキー (ログ出力用)
+        max_pages (int): 処理する最大ページ数。デフォルトは1。
+        dpi (int): 画像変換時の解像度（DPI）。デフォルトは150。
 
-            img_bytes = pix.tobytes("png")
+    Returns:
+        list[google.cloud.vision.AnnotateImageResponse]: extract_ocr_data_from_pdfと同じ
+    """
+    try:
+        responses = []
 
-            image = vision.Image(content=img_bytes)
-            logger.info(f"Requesting document text detection for PDF page {page_num+1}")
-            response = client.document_text_detection(image=image)
+        pages = _render_pdf_pages(content, pdf_path, max_pages=max_pages, dpi=dpi)
 
+        # ページを1ページずつ順に送信せず、batch_annotate_imagesでまとめて送信する
+        for page_num, response in enumerate(_annotate_in_batches(pages)):
             if response.error.message:
                 logger.error(f"Vision API error for PDF {pdf_path} page {page_num+1}: {response.error.message}")
                 continue
@@ -125,4 +380,54 @@ def extract_ocr_data_from_pdf(pdf_path, max_pages=1, dpi=150):
 
     except Exception as e:
         logger.error(f"Error extracting OCR data from PDF {pdf_path}: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def _render_pdf_pages(content, pdf_path, max_pages=1, dpi=150):
+    """
+    PDFの先頭から最大max_pagesページを、指定したDPIの画像に変換する
+
+    Args:
+        content (bytes): PDFの内容
+        pdf_path (str): PDFのパスまたはS3オブジェクトキー (ログ出力用)
+        max_pages (int): 変換する最大ページ数。デフォルトは1。
+        dpi (int): 画像変換時の解像度（DPI）。デフォルトは150。
+
+    Returns:
+        list[bytes]: ページごとの画像 (PDF_PAGE_IMAGE_FORMAT の形式) のリスト
+    """
+    # PyMuPDFはインポートに時間がかかるため、利用時に読み込む (コールドスタート短縮)
+    import fitz  # PyMuPDF
+
+    # PDFの元の解像度を保持するため、変換マトリックスを計算
+    # 指定されたDPIで画像を生成
+    zoom = dpi / 72  # 72dpiがPyMuPDFのデフォルト
+    colorspace = fitz.csGRAY if PDF_PAGE_GRAYSCALE else fitz.csRGB
+
+    pages = []
+    with _pdf_render_lock:
+        # ウォームスタート時にMuPDFのメモリが残らないよう、ドキュメントは処理後に明示的に閉じる
+        with fitz.open(stream=content, filetype="pdf") as pdf_document:
+            num_pages_to_process = min(len(pdf_document), max_pages)
+
+            logger.info(f"Processing {num_pages_to_process} page(s) out of {len(pdf_document)} for PDF: {pdf_path} at {dpi} DPI")
+
+            for page_num in range(num_pages_to_process):
+                logger.info(f"Processing PDF page {page_num+1}/{num_pages_to_process}")
+                page = pdf_document.load_page(page_num)
+                page_zoom = zoom
+                if PDF_PAGE_MAX_DIMENSION > 0:
+                    # 長辺が上限を超えるページは、上限に収まるよう倍率を下げる
+                    page_zoom = min(zoom, PDF_PAGE_MAX_DIMENSION / max(page.rect.width, page.rect.height, 1))
+                pix = page.get_pixmap(matrix=fitz.Matrix(page_zoom, page_zoom), colorspace=colorspace, alpha=False)
+                if PDF_PAGE_IMAGE_FORMAT == "jpeg":
+                    pages.append(pix.tobytes("jpeg", jpg_quality=PDF_PAGE_JPEG_QUALITY))
+                else:
+                    pages.append(pix.tobytes("png"))
+                # 次のページの描画前にピクセルデータを解放する (2ページ分のピクセルデータを同時に保持しない)
+                del pix, page
+
+        # 閉じたドキュメントのフォント・画像がMuPDFのストア (キャッシュ) に残り、ウォームスタートごとにメモリが増えないよう空にする
+        # (ストアはプロセス全体で共有されるため、他の変換と重ならないようロック内で行う)
+        fitz.TOOLS.store_shrink(100)
+
+    return pages
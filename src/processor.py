@@ -1,9 +1,14 @@
+from __future__ import annotations
+
 import re
 from datetime import datetime
-from google.cloud import vision  # Vision APIの型ヒントのためにインポート
-from typing import List, Dict, Any, Union  # 型ヒントをインポート
+from typing import TYPE_CHECKING, List, Dict, Any, NamedTuple, Union  # 型ヒントをインポート
 from src.utils.logger import setup_logger
 
+if TYPE_CHECKING:
+    # Vision APIの型ヒントのためにインポート (実行時はインポートせず、コールドスタートを短縮する)
+    from google.cloud import vision
+
 logger = setup_logger()
 
 # --- Bounding Box Corrector ヘルパー関数群 ---
@@ -89,32 +94,59 @@ def normalize_value(value, field_type="text"):
         text = re.sub(r'\s+', ' ', text).strip()
         return text
 
-def find_matching_word_sequence(target_value, sorted_words, field_type="text"):
-    """正規化された値に一致する連続したOCR単語シーケンスを見つける"""
+def word_text(word):
+    """OCR単語のシンボルを連結した文字列を返す"""
+    return "".join([symbol.text for symbol in word.symbols])
+
+def find_matching_word_sequence(target_value, sorted_words, field_type="text", word_texts=None):
+    """
+    正規化された値に一致する連続したOCR単語シーケンスを見つける
+    一致するシーケンスが複数ある場合は、最も短く、その中で最も先頭に近いものを返す
+    word_textsにはsorted_wordsの各単語のword_textを渡せる (省略した場合はここで組み立てる)
+    """
     normalized_target = normalize_value(target_value, field_type)
     if not normalized_target or not sorted_words:
         return None
 
-    n = len(sorted_words)
-    for length in range(1, n + 1):
-        for i in range(n - length + 1):
-            sequence = sorted_words[i : i + length]
-            combined_text = "".join([symbol.text for word in sequence for symbol in word.symbols])
-            normalized_combined = normalize_value(combined_text, field_type)
-
-            match = False
-            if field_type == "number" or field_type == "date":
-                if normalized_combined == normalized_target:
-                    match = True
-            else:
-                normalized_combined_text_for_search = normalize_value(combined_text, "text")
-                if normalized_combined_text_for_search == normalized_target or normalized_target in normalized_combined_text_for_search:
-                    match = True
-            
-            if match:
-                return sequence
-
-    return None
+    # 単語ごとの文字列は1回だけ組み立てる (シーケンスごとにsymbolsを辿り直さない)
+    if word_texts is None:
+        word_texts = [word_text(word) for word in sorted_words]
+    n = len(word_texts)
+    # 見つかった中で最も短いシーケンスの (長さ, 開始位置)
+    best = None
+
+    if field_type == "number" or field_type == "date":
+        # 完全一致は単語を足すと一致しなくなる場合があるため、開始位置ごとに伸ばしながら照合する
+        # (それまでに見つかったシーケンスより短いものだけを調べる)
+        for i in range(n):
+            max_length = n - i if best is None else min(n - i, best[0] - 1)
+            combined_text = ""
+            for length in range(1, max_length + 1):
+                combined_text += word_texts[i + length - 1]
+                if normalize_value(combined_text, field_type) == normalized_target:
+                    best = (length, i)
+                    break
+            if best is not None and best[0] == 1:
+                break
+    else:
+        # 部分一致は単語を足しても一致したままのため、開始位置と終了位置を左から右へ1回ずつ動かす
+        # (開始位置を進めても、一致する最短の終了位置は手前に戻らない)
+        end = 0
+        for i in range(n):
+            end = max(end, i + 1)
+            while end <= n and normalized_target not in normalize_value("".join(word_texts[i:end]), "text"):
+                end += 1
+            if end > n:
+                break
+            if best is None or end - i < best[0]:
+                best = (end - i, i)
+                if best[0] == 1:
+                    break
+
+    if best is None:
+        return None
+    length, i = best
+    return sorted_words[i : i + length]
 
 def calculate_minimum_bbox(words):
     """単語リストから最小のbboxを計算"""
@@ -129,30 +161,70 @@ def calculate_minimum_bbox(words):
     vertices_list = [{'x': v.x, 'y': v.y} for v in all_vertices]
     return vertices_to_bbox(vertices_list)
 
-def correct_bounding_boxes_recursive(data, ocr_words):
-    """抽出データ内のbboxを再帰的に補正する"""
+class WordBoxes(NamedTuple):
+    """ページ内のOCR単語について、フィールドごとの補正で使い回す情報"""
+    # bboxを持つ単語 (sort_words_naturallyの順)
+    words: list
+    # 各単語の (min_x, min_y, max_x, max_y)
+    bounds: List[tuple]
+    # 各単語のword_text
+    texts: List[str]
+
+def build_word_boxes(ocr_words):
+    """
+    OCR単語の読み順・bbox・文字列を、フィールドごとの補正で使い回せるよう1回だけ計算する
+
+    Returns:
+        WordBoxes: bboxを持つ単語を読み順に並べたものと、そのbbox・文字列
+    """
+    # 全単語を1回だけ並べておけば、重なる単語を絞り込んだ結果も読み順になる (同じ位置の単語の順序もsort_words_naturallyと同じ)
+    boxed_words = sort_words_naturally([word for word in ocr_words if word.bounding_box and word.bounding_box.vertices])
+    bounds = []
+    for word in boxed_words:
+        xs = [v.x for v in word.bounding_box.vertices]
+        ys = [v.y for v in word.bounding_box.vertices]
+        bounds.append((min(xs), min(ys), max(xs), max(ys)))
+    return WordBoxes(boxed_words, bounds, [word_text(word) for word in boxed_words])
+
+def find_overlapping_word_indices(llm_bbox, word_boxes):
+    """
+    LLMのbboxと重なるOCR単語を、build_word_boxesで計算したbboxに対して判定する (bbox_overlapと同じ判定)
+
+    Returns:
+        list[int]: 重なる単語のword_boxes内のインデックス (読み順)
+    """
+    x_min, y_min = llm_bbox['x'], llm_bbox['y']
+    x_max, y_max = x_min + llm_bbox['width'], y_min + llm_bbox['height']
+    return [k for k, (word_x_min, word_y_min, word_x_max, word_y_max) in enumerate(word_boxes.bounds)
+            if not (x_max < word_x_min or word_x_max < x_min or y_max < word_y_min or word_y_max < y_min)]
+
+def correct_bounding_boxes_recursive(data, ocr_words, word_boxes=None):
+    """
+    抽出データ内のbboxを再帰的に補正する
+    word_boxesにはbuild_word_boxes(ocr_words)の結果を渡す (省略した場合はここで計算する)
+    """
+    if word_boxes is None and isinstance(data, (dict, list)):
+        word_boxes = build_word_boxes(ocr_words)
+
     if isinstance(data, dict):
         corrected_data = {}
         field_value = data.get("value")
         llm_bbox = data.get("bbox")
         
         if field_value is not None and isinstance(llm_bbox, dict) and all(k in llm_bbox for k in ['x', 'y', 'width', 'height']):
-            overlapping_words = []
-            for word in ocr_words:
-                if word.bounding_box and word.bounding_box.vertices:
-                    ocr_bbox = vertices_to_bbox([{'x': v.x, 'y': v.y} for v in word.bounding_box.vertices])
-                    if ocr_bbox and bbox_overlap(llm_bbox, ocr_bbox):
-                        overlapping_words.append(word)
-
-            if overlapping_words:
-                sorted_overlapping_words = sort_words_naturally(overlapping_words)
+            overlapping_indices = find_overlapping_word_indices(llm_bbox, word_boxes)
+
+            if overlapping_indices:
+                sorted_overlapping_words = [word_boxes.words[k] for k in overlapping_indices]
                 field_type = "text"
                 if isinstance(field_value, (int, float)) or re.match(r'^[\d,¥￥.]+$', str(field_value)):
                     field_type = "number"
                 elif isinstance(field_value, str) and re.search(r'\d{4}[-/年]\d{1,2}[-/月]\d{1,2}日?', field_value):
                     field_type = "date"
 
-                matching_sequence = find_matching_word_sequence(field_value, sorted_overlapping_words, field_type)
+                matching_sequence = find_matching_word_sequence(
+                    field_value, sorted_overlapping_words, field_type, [word_boxes.texts[k] for k in overlapping_indices]
+                )
                 
                 if matching_sequence:
                     corrected_bbox = calculate_minimum_bbox(matching_sequence)
@@ -168,18 +240,18 @@ def correct_bounding_boxes_recursive(data, ocr_words):
 
             for key, value in data.items():
                 if key not in ["value", "bbox"]:
-                    corrected_data[key] = correct_bounding_boxes_recursive(value, ocr_words)
+                    corrected_data[key] = correct_bounding_boxes_recursive(value, ocr_words, word_boxes)
             
             return corrected_data
 
         else:
             corrected_dict = {}
             for key, value in data.items():
-                corrected_dict[key] = correct_bounding_boxes_recursive(value, ocr_words)
+                corrected_dict[key] = correct_bounding_boxes_recursive(value, ocr_words, word_boxes)
             return corrected_dict
 
     elif isinstance(data, list):
-        return [correct_bounding_boxes_recursive(item, ocr_words) for item in data]
+        return [correct_bounding_boxes_recursive(item, ocr_words, word_boxes) for item in data]
     else:
         return data
 
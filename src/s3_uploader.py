@@ -1,25 +1,29 @@
-import boto3
 import os
 from botocore.exceptions import ClientError
 from src.utils.logger import setup_logger
+from src.utils.clients import get_s3_client
 
 logger = setup_logger()
 
-def upload_to_s3(data: str, bucket_name: str, object_key: str) -> bool:
+def upload_to_s3(data: str | bytes, bucket_name: str, object_key: str, content_encoding: str | None = None) -> bool:
     """
     指定されたデータをS3バケットにアップロードします。
 
     Args:
-        data: アップロードするデータ（文字列）。
+        data: アップロードするデータ（文字列、またはUTF-8でエンコード済みのバイト列）。
         bucket_name: アップロード先のS3バケット名。
         object_key: S3オブジェクトキー。
+        content_encoding: dataを圧縮済みの場合の圧縮形式 (例: "gzip")。オブジェクトのContent-Encodingに設定する。
 
     Returns:
         アップロードが成功した場合はTrue、失敗した場合はFalse。
     """
-    s3_client = boto3.client('s3')
+    s3_client = get_s3_client()
+    # orjson等でシリアライズ済みのバイト列はそのまま送信する (再エンコードを省略)
+    body = data.encode('utf-8') if isinstance(data, str) else data
+    extra_args = {'ContentEncoding': content_encoding} if content_encoding else {}
     try:
-        s3_client.put_object(Bucket=bucket_name, Key=object_key, Body=data.encode('utf-8'))
+        s3_client.put_object(Bucket=bucket_name, Key=object_key, Body=body, **extra_args)
         logger.info(f"Successfully uploaded data to s3://{bucket_name}/{object_key}")
         return True
     except ClientError as e:
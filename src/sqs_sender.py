@@ -1,13 +1,19 @@
 import os
-import json
-import boto3
+import orjson
 from src.utils.logger import setup_logger
+from src.utils.clients import get_sqs_client
 
 logger = setup_logger()
 
 # 送信先のSQSキューURLを環境変数から取得
 OUTPUT_QUEUE_URL = os.environ.get("OUTPUT_QUEUE_URL")
 
+def _dumps_message(message):
+    """
+    送信データをJSON文字列に変換する (orjsonを使用し、numpyの数値もそのまま変換する)
+    """
+    return orjson.dumps(message, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
 def send_to_queue(processed_data):
     """
     処理結果をSQSキューに送信する
@@ -21,11 +27,11 @@ def send_to_queue(processed_data):
     logger.info("Sending processed data to SQS")
     
     try:
-        # SQSクライアントの初期化
-        sqs_client = boto3.client('sqs')
+        # SQSクライアントの取得 (ウォームスタート間で共有)
+        sqs_client = get_sqs_client()
         
         # 送信データの形式変換（必要に応じて）
-        message_body = json.dumps(processed_data)
+        message_body = _dumps_message(processed_data)
         
         # SQSにメッセージを送信
         response = sqs_client.send_message(
@@ -40,4 +46,96 @@ def send_to_queue(processed_data):
         
     except Exception as e:
         logger.error(f"Error sending message to SQS: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+# SendMessageBatch の上限 (1リクエストあたりの件数と合計サイズ)
+SQS_BATCH_MAX_ENTRIES = 10
+SQS_BATCH_MAX_BYTES = 256 * 1024
+
+def _build_batch_entries(messages):
+    """
+    送信データをSendMessageBatchのエントリに変換し、件数・サイズの上限ごとに分割する
+
+    Args:
+        messages (list[dict]): 送信するデータのリスト
+
+    Returns:
+        list[list[dict]]: バッチごとのエントリのリスト。Idは messages のインデックス
+    """
+    batches = []
+    current_batch = []
+    current_size = 0
+    for index, message in enumerate(messages):
+        message_body = _dumps_message(message)
+        body_size = len(message_body.encode('utf-8'))
+        if current_batch and (len(current_batch) >= SQS_BATCH_MAX_ENTRIES or current_size + body_size > SQS_BATCH_MAX_BYTES):
+            batches.append(current_batch)
+            current_batch = []
+            current_size = 0
+        current_batch.append({'Id': str(index), 'MessageBody': message_body})
+        current_size += body_size
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+def send_batch_to_queue(messages):
+    """
+    複数の処理結果をSendMessageBatchでまとめてSQSキューに送信する
+    バッチ内で送信に失敗したメッセージは、SendMessageで個別に再送する
+    再送でも送信できなかったメッセージがあっても例外は送出せず、送信できたメッセージのIDとあわせて返す
+    (呼び出し元で送信できなかったメッセージのみ再処理できるようにする)
+
+    Args:
+        messages (list[dict]): 送信するデータのリスト
+
+    Returns:
+        list[str | None]: 送信したメッセージのID (messages と同じ順序)。送信できなかったメッセージはNone
+    """
+    logger.info(f"Sending {len(messages)} processed data to SQS in batches")
+
+    try:
+        # SQSクライアントの取得 (ウォームスタート間で共有)
+        sqs_client = get_sqs_client()
+
+        message_ids = [None] * len(messages)
+        failed_entries = []
+        for entries in _build_batch_entries(messages):
+            try:
+                response = sqs_client.send_message_batch(
+                    QueueUrl=OUTPUT_QUEUE_URL,
+                    Entries=entries
+                )
+            except Exception as e_batch:
+                # 送信済みのバッチのメッセージIDを失わないよう、このバッチの全エントリを失敗として個別に再送する
+                logger.error(f"Failed to send message batch to SQS: {str(e_batch)}")
+                response = {'Failed': [{'Id': entry['Id'], 'Code': type(e_batch).__name__, 'Message': str(e_batch)}
+                                       for entry in entries]}
+            for entry in response.get('Successful', []):
+                message_ids[int(entry['Id'])] = entry.get('MessageId')
+            message_bodies = {entry['Id']: entry['MessageBody'] for entry in entries}
+            failed_entries.extend((entry, message_bodies[entry['Id']]) for entry in response.get('Failed', []))
+
+        unsent_count = 0
+        for entry, message_body in failed_entries:
+            logger.error(f"Failed to send message to SQS. Id: {entry.get('Id')}, Code: {entry.get('Code')}, Message: {entry.get('Message')}")
+            # 送信側の誤り (SenderFault) は再送しても成功しないため、それ以外のみ個別に再送する
+            if entry.get('SenderFault'):
+                unsent_count += 1
+                continue
+            try:
+                response = sqs_client.send_message(QueueUrl=OUTPUT_QUEUE_URL, MessageBody=message_body)
+                message_ids[int(entry['Id'])] = response.get('MessageId')
+                logger.info(f"Resent message to SQS individually. Id: {entry.get('Id')}")
+            except Exception as e_resend:
+                logger.error(f"Failed to resend message to SQS. Id: {entry.get('Id')}: {str(e_resend)}")
+                unsent_count += 1
+
+        if unsent_count:
+            logger.error(f"Failed to send {unsent_count} of {len(messages)} messages to SQS")
+
+        logger.info(f"Messages sent to SQS. MessageIds: {message_ids}")
+        return message_ids
+
+    except Exception as e:
+        logger.error(f"Error sending message batch to SQS: {str(e)}")
+        raise
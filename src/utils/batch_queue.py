@@ -0,0 +1,60 @@
+import asyncio
+from typing import Any, Callable, List
+
+class AsyncBatchQueue:
+    """
+    並行して投入された要素を一定数または一定時間ごとにまとめて処理するキュー
+
+    submit() で投入された要素は、max_batch_size 件たまるか、最初の要素の投入から
+    max_wait_seconds 経過した時点でまとめて process_batch に渡される。
+    process_batch は同期関数で、スレッドで実行される。要素と同じ順序で結果のリストを返すこと。
+    イベントループごとに作成すること。
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait_seconds: float):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._pending: List[tuple] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set = set()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        要素を投入し、その要素の処理結果を返す。まとめて処理した際に例外が発生した場合はそれを送出する。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_seconds, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            # 実行中のタスクがGCされないよう参照を保持する
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[tuple]) -> None:
+        try:
+            results = await asyncio.to_thread(self.process_batch, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
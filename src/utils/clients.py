@@ -0,0 +1,67 @@
+import os
+import threading
+from typing import Any, Callable, Dict
+import boto3
+from botocore.config import Config
+
+# boto3クライアントのコネクションプールの上限
+# 同時ダウンロード数 (DOWNLOAD_CONCURRENCY) x 1オブジェクトあたりの範囲取得の並列数 (8) に加え、
+# HEAD・アップロードの分も接続を使い回せるようにする (プールが溢れると接続が破棄され再接続が発生する)
+BOTO_MAX_POOL_CONNECTIONS = int(os.environ.get("BOTO_MAX_POOL_CONNECTIONS", "128"))
+
+# boto3クライアントの共通設定
+# 並行処理時にも接続を使い回せるようコネクションプールを拡張し、keep-aliveを有効にする
+BOTO_CLIENT_CONFIG = Config(
+    max_pool_connections=BOTO_MAX_POOL_CONNECTIONS,
+    retries={"mode": "standard"},
+    tcp_keepalive=True,
+)
+
+# Lambdaのウォームスタート間で再利用するクライアントのキャッシュ
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+def _get_or_create(name: str, factory: Callable[[], Any]) -> Any:
+    """
+    キャッシュ済みのクライアントを返す。未作成の場合はfactoryで作成してキャッシュする。
+    boto3のデフォルトセッションはスレッドセーフではないため、作成はロック内で行う。
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+def get_s3_client() -> Any:
+    """
+    プロセス内で共有するS3クライアントを取得する
+
+    Returns:
+        botocore.client.S3: S3クライアント
+    """
+    return _get_or_create('s3', lambda: boto3.client('s3', config=BOTO_CLIENT_CONFIG))
+
+def get_sqs_client() -> Any:
+    """
+    プロセス内で共有するSQSクライアントを取得する
+
+    Returns:
+        botocore.client.SQS: SQSクライアント
+    """
+    return _get_or_create('sqs', lambda: boto3.client('sqs', config=BOTO_CLIENT_CONFIG))
+
+def get_vision_client() -> Any:
+    """
+    プロセス内で共有するGoogle Cloud Visionクライアントを取得する
+
+    Returns:
+        google.cloud.vision.ImageAnnotatorClient: Visionクライアント
+    """
+    def _create_vision_client():
+        from google.cloud import vision
+        return vision.ImageAnnotatorClient()
+
+    return _get_or_create('vision', _create_vision_client)
@@ -47,15 +47,19 @@ def _convert_vertices_to_simple_box(vertices):
     if not vertices or len(vertices) != 4:
         return None
     try:
+        # protoのrepeatedフィールドは添字アクセスのたびにラッパーを生成するため、各頂点は1回だけ取り出す
+        top_left = vertices[0]
         # 左上の座標
-        x = vertices[0].x
-        y = vertices[0].y
+        x = top_left.x
+        y = top_left.y
         # 幅と高さ (右上のx - 左上のx, 左下のy - 左上のy)
-        width = vertices[1].x - vertices[0].x
-        height = vertices[3].y - vertices[0].y
+        width = vertices[1].x - x
+        height = vertices[3].y - y
         # Ensure non-negative dimensions
-        width = max(0, width)
-        height = max(0, height)
+        if width < 0:
+            width = 0
+        if height < 0:
+            height = 0
         return {'x': x, 'y': y, 'width': width, 'height': height}
     except (AttributeError, IndexError, TypeError) as e:
         print(f"Error converting vertices: {e}. Vertices: {vertices}")
@@ -78,12 +82,14 @@ def _process_element_to_dict(element):
 
     # バウンディングボックスを処理し、シンプル形式のみ追加
     bounding_poly = getattr(element, 'bounding_poly', None)
-    bounding_box = getattr(element, 'boundingBox', None)
     vertices = None
     if bounding_poly and hasattr(bounding_poly, 'vertices'):
         vertices = bounding_poly.vertices
-    elif bounding_box and hasattr(bounding_box, 'vertices'):
-        vertices = bounding_box.vertices
+    else:
+        # bounding_poly がない場合のみ参照する (存在しない属性の参照は例外処理を伴うため)
+        bounding_box = getattr(element, 'boundingBox', None)
+        if bounding_box and hasattr(bounding_box, 'vertices'):
+            vertices = bounding_box.vertices
 
     if vertices:
         simple_box = _convert_vertices_to_simple_box(vertices)
@@ -99,11 +105,91 @@ def _process_element_to_dict(element):
 
     return element_dict
 
+def _convert_text_annotations(raw_annotations):
+    """
+    textAnnotations (生のprotobuf) をまとめて辞書のリストに変換する
+
+    生のprotobufの頂点を1回ずつ参照し、シンプル形式のBBを計算する。
+    出力は _process_element_to_dict と同じ形式。
+    """
+    results = []
+    for raw in raw_annotations:
+        element_dict = {'description': raw.description, 'locale': raw.locale, 'confidence': raw.confidence}
+        vertices = raw.bounding_poly.vertices
+        # 頂点が4つあるアノテーションのみシンプル形式のBBを持つ
+        if len(vertices) == 4:
+            top_left = vertices[0]
+            x = top_left.x
+            y = top_left.y
+            # 左上の座標と、幅 (右上のx - 左上のx)・高さ (左下のy - 左上のy)。負の値は0にする
+            element_dict['simple_bounding_box'] = {
+                'x': x, 'y': y, 'width': max(vertices[1].x - x, 0), 'height': max(vertices[3].y - y, 0)
+            }
+        results.append(element_dict)
+    return results
+
+def _convert_full_text_annotation(raw_full_text):
+    """
+    fullTextAnnotation (生のprotobuf) を階層的な辞書に変換する
+    出力は convert_single_response_bounding_box の汎用処理と同じ形式
+    (block / paragraph / word / symbol はシンプル形式のBBを持たない)。
+    """
+    return {
+        'text': raw_full_text.text,
+        'pages': [
+            {
+                'width': page.width,
+                'height': page.height,
+                'blocks': [
+                    {
+                        'confidence': block.confidence,
+                        'paragraphs': [
+                            {
+                                'confidence': paragraph.confidence,
+                                'words': [
+                                    {
+                                        'confidence': word.confidence,
+                                        'symbols': [
+                                            {'text': symbol.text, 'confidence': symbol.confidence}
+                                            for symbol in word.symbols
+                                        ],
+                                    }
+                                    for word in paragraph.words
+                                ],
+                            }
+                            for paragraph in block.paragraphs
+                        ],
+                    }
+                    for block in page.blocks
+                ],
+            }
+            for page in raw_full_text.pages
+        ],
+    }
+
+def _convert_vision_response(raw_response):
+    """
+    Vision APIのレスポンス (生のprotobuf) を、シンプルBBを持つ軽量な辞書に変換する
+    型が確定しているため、hasattr による属性の探索を行わずにフィールドを直接参照する。
+    """
+    result_dict = {}
+    if len(raw_response.text_annotations):
+        result_dict['textAnnotations'] = _convert_text_annotations(raw_response.text_annotations)
+    if raw_response.full_text_annotation.ByteSize():
+        result_dict['fullTextAnnotation'] = _convert_full_text_annotation(raw_response.full_text_annotation)
+    return result_dict
+
 def convert_single_response_bounding_box(response):
     """単一のOCRレスポンスオブジェクトを、シンプルBBを持つ軽量な辞書に変換する"""
     if not response:
         return None
 
+    # Vision APIのレスポンス (proto-plusのメッセージ) は型に応じた変換を行う
+    import proto  # Vision SDKと共に読み込まれるため、利用時に参照する
+    if isinstance(response, proto.Message):
+        return _convert_vision_response(type(response).pb(response))
+
+    # それ以外のオブジェクトは属性の有無を確認しながら変換する
     result_dict = {}
 
     # 1. textAnnotations を処理 -> description と simple_bounding_box のみ持つ辞書のリスト
@@ -184,8 +270,10 @@ def clean_temp_files(file_paths):
         file_paths (list): 削除するファイルパスのリスト
     """
     for file_path in file_paths:
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                print(f"Error removing temp file {file_path}: {str(e)}")
+        # 存在確認をせずに削除し、存在しない場合は無視する (確認と削除の間の競合を避ける)
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error removing temp file {file_path}: {str(e)}")
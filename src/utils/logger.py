@@ -1,6 +1,6 @@
 import logging
 import os
-import json
+import orjson
 import bugsnag  # Bugsnag をインポート
 from bugsnag.handlers import BugsnagHandler  # BugsnagHandler をインポート
 
@@ -62,7 +62,8 @@ def setup_logger(name='ai-clipping-lambda'):
                     if record.exc_info:
                         log_record['exception'] = self.formatException(record.exc_info)
                     
-                    return json.dumps(log_record)
+                    # 抽出結果などの大きなメッセージも1行ごとにJSON化するため、orjsonで高速に変換する
+                    return orjson.dumps(log_record).decode()
                     
             formatter = JsonFormatter()
         else:
@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+from src.utils.batch_queue import AsyncBatchQueue
+
+
+class TestAsyncBatchQueue(unittest.TestCase):
+
+    def test_flushes_when_batch_is_full(self):
+        """上限件数に達した時点でまとめて処理されることをテスト"""
+        batches = []
+
+        def process_batch(items):
+            batches.append(list(items))
+            return [item * 10 for item in items]
+
+        async def run():
+            queue = AsyncBatchQueue(process_batch, max_batch_size=2, max_wait_seconds=10)
+            return await asyncio.gather(*(queue.submit(i) for i in range(4)))
+
+        results = asyncio.run(run())
+
+        self.assertEqual(results, [0, 10, 20, 30])
+        self.assertEqual(batches, [[0, 1], [2, 3]])
+
+    def test_flushes_after_max_wait(self):
+        """上限件数に達しなくても待ち時間の経過後に処理されることをテスト"""
+        batches = []
+
+        def process_batch(items):
+            batches.append(list(items))
+            return items
+
+        async def run():
+            queue = AsyncBatchQueue(process_batch, max_batch_size=10, max_wait_seconds=0.01)
+            return await asyncio.gather(queue.submit("a"), queue.submit("b"))
+
+        self.assertEqual(asyncio.run(run()), ["a", "b"])
+        self.assertEqual(batches, [["a", "b"]])
+
+    def test_propagates_batch_errors(self):
+        """まとめた処理で発生した例外が全ての投入元に送出されることをテスト"""
+        def process_batch(items):
+            raise RuntimeError("LLM error")
+
+        async def run():
+            queue = AsyncBatchQueue(process_batch, max_batch_size=2, max_wait_seconds=10)
+            return await asyncio.gather(queue.submit(1), queue.submit(2), return_exceptions=True)
+
+        results = asyncio.run(run())
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+from src.utils.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        """上限を超えた場合に最も長く使われていない値が破棄されることをテスト"""
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # "a" を最近使用したものにする
+
+        cache.put("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_disabled_when_maxsize_is_zero(self):
+        """上限が0の場合は値を保持しないことをテスト"""
+        cache = LRUCache(0)
+        cache.put("a", 1)
+
+        self.assertEqual(cache.get("a", "missing"), "missing")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from botocore.exceptions import ClientError
+from src.download import download_bytes
+
+
+def create_range_response(content, start, end, total_size):
+    body = MagicMock()
+    body.read.return_value = content[start:end + 1]
+    return {"Body": body, "ContentRange": f"bytes {start}-{min(end, total_size - 1)}/{total_size}", "ETag": '"etag"'}
+
+
+class TestDownload(unittest.TestCase):
+
+    @patch('src.download.S3_RANGE_PART_SIZE', 4)
+    @patch('src.download.get_s3_client')
+    def test_download_bytes_small_object_uses_single_get(self, mock_get_client):
+        """パートサイズ以下のオブジェクトは1回のGETで取得されることをテスト"""
+        content = b"abc"
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = lambda Bucket, Key, Range: create_range_response(content, 0, 3, len(content))
+        mock_get_client.return_value = mock_client
+
+        result = download_bytes("bucket", "a.png")
+
+        self.assertEqual(result, content)
+        mock_client.get_object.assert_called_once_with(Bucket="bucket", Key="a.png", Range="bytes=0-3")
+
+    @patch('src.download.S3_RANGE_PART_SIZE', 4)
+    @patch('src.download.get_s3_client')
+    def test_download_bytes_large_object_uses_range_parts(self, mock_get_client):
+        """パートサイズを超えるオブジェクトは範囲指定GETで分割取得され、順序通りに結合されることをテスト"""
+        content = b"0123456789"
+
+        def get_object(Bucket, Key, Range, IfMatch=None):
+            start, end = (int(v) for v in Range.removeprefix("bytes=").split("-"))
+            return create_range_response(content, start, end, len(content))
+
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = get_object
+        mock_get_client.return_value = mock_client
+
+        result = download_bytes("bucket", "a.pdf")
+
+        self.assertEqual(result, content)
+        self.assertEqual(mock_client.get_object.call_count, 3)
+        mock_client.get_object.assert_any_call(Bucket="bucket", Key="a.pdf", IfMatch='"etag"', Range="bytes=8-9")
+
+    @patch('src.download.get_s3_client')
+    def test_download_bytes_empty_object(self, mock_get_client):
+        """0バイトのオブジェクトは通常のGETで取得されることをテスト"""
+        body = MagicMock()
+        body.read.return_value = b""
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = [
+            ClientError({"Error": {"Code": "InvalidRange", "Message": "range not satisfiable"}}, "GetObject"),
+            {"Body": body},
+        ]
+        mock_get_client.return_value = mock_client
+
+        self.assertEqual(download_bytes("bucket", "empty.png"), b"")
+
+
+if __name__ == '__main__':
+    unittest.main()
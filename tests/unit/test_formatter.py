@@ -301,51 +301,43 @@ class TestFormatter(unittest.TestCase):
 
     def test_format_sqs_message_bank_duplicate_removal(self):
         """bankフィールドの重複除去のテスト"""
+        bank_bbox = {"x": 10.0, "y": 20.0, "width": 200.0, "height": 100.0}
         processed_data = {
             "processed": True,
             "corrected_data": {
-                "bank_details": {
-                    "bbox": {"x": 10.0, "y": 20.0, "width": 200.0, "height": 100.0}
-                }
+                # 同じbboxを持つbank要素を複数作成
+                "bank_details": [
+                    {"bbox": dict(bank_bbox)},
+                    {"bbox": dict(bank_bbox)},
+                    {"bbox": dict(bank_bbox), "page": 2}
+                ]
             }
         }
-        
-        # 2回処理して重複がないことを確認するために、同じbboxを持つbank要素を複数作成
+
+        internal_clips = convert_to_clips_format_recursive(processed_data["corrected_data"], page=1)
+        result = format_sqs_message(processed_data, "test_request_id", "test_s3_key")
+
+        # 重複したbankクリップはページごとに1つのみになる
+        self.assertEqual([clip["page"] for clip in internal_clips], [1, 2])
+        self.assertEqual(len(result["clips"]), 2)
+        self.assertEqual([clip["field_name"] for clip in result["clips"]], ["bank", "bank"])
+        self.assertEqual([clip["page"] for clip in result["clips"]], [1, 2])
+
+    def test_format_sqs_message_skips_conversion_without_bbox(self):
+        """bboxが1つも存在しない場合にクリップの生成が省略されることをテスト"""
+        processed_data = {
+            "processed": True,
+            "corrected_data": {
+                "field1": {"value": "test_value", "bbox": None},
+                "items": [{"field2": {"value": "value2"}}]
+            }
+        }
+
         with patch('src.formatter.convert_to_clips_format_recursive') as mock_convert:
-            mock_convert.return_value = [
-                {
-                    "field_name": "bank",
-                    "value": "",
-                    "position": {
-                        "bounding_box": [
-                            {"x": 10.0, "y": 20.0},
-                            {"x": 210.0, "y": 20.0},
-                            {"x": 210.0, "y": 120.0},
-                            {"x": 10.0, "y": 120.0},
-                        ]
-                    },
-                    "page": 1
-                },
-                {
-                    "field_name": "bank",
-                    "value": "",
-                    "position": {
-                        "bounding_box": [
-                            {"x": 10.0, "y": 20.0},
-                            {"x": 210.0, "y": 20.0},
-                            {"x": 210.0, "y": 120.0},
-                            {"x": 10.0, "y": 120.0},
-                        ]
-                    },
-                    "page": 1
-                }
-            ]
-            
             result = format_sqs_message(processed_data, "test_request_id", "test_s3_key")
-            
-            # 重複したbankクリップは1つのみになる
-            self.assertEqual(len(result["clips"]), 1)
-            self.assertEqual(result["clips"][0]["field_name"], "bank")
+
+        mock_convert.assert_not_called()
+        self.assertEqual(result["clips"], [])
 
     def test_format_sqs_message_invalid_bbox_format(self):
         """無効なbbox形式の処理のテスト"""
@@ -419,5 +411,31 @@ class TestFormatter(unittest.TestCase):
         self.assertIn("items.field2", field_names)
 
 
+    def test_convert_to_clips_format_recursive_order_and_deep_nesting(self):
+        """クリップがデータの順序で生成され、深くネストしたデータも処理できることをテスト"""
+        bbox = {"x": 10.0, "y": 20.0, "width": 100.0, "height": 50.0}
+        data = {
+            "amount_info": {
+                "tax_breakdown": [
+                    {"other": {"value": "1", "bbox": bbox}},
+                    {"tax_rate": {"value": 0.1}, "amount_include_tax": {"value": "1100", "bbox": bbox}},
+                ],
+                "total_amount": {"value": "1100", "bbox": bbox},
+            },
+            "field1": {"value": "a", "bbox": bbox},
+        }
+
+        result = convert_to_clips_format_recursive(data)
+
+        self.assertEqual([clip["field_name"] for clip in result],
+                         ["amount_info.tax_breakdown.other", "taxable_amount_for_10_percent", "total_amount", "field1"])
+
+        deep = {"value": "deep", "bbox": bbox}
+        for _ in range(2000):
+            deep = {"child": deep}
+        with patch('src.formatter.logger'):
+            result = convert_to_clips_format_recursive(deep)
+        self.assertEqual(len(result), 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,9 @@
+import asyncio
+import gzip
 import json
 import unittest
 import os
+import threading
 from unittest.mock import patch, MagicMock, ANY
 
 # Vision APIレスポンスのモックを作成するヘルパー関数
@@ -11,6 +14,14 @@ def create_mock_ocr_response(text):
 
 class TestHandler(unittest.TestCase):
 
+    def setUp(self):
+        import handler
+        # OCR結果のキャッシュはウォームスタート間で共有されるため、テストごとに空にする
+        handler._ocr_cache.clear()
+        etag_patcher = patch('handler.get_object_etag', side_effect=lambda bucket, key: f'"etag-{key}"')
+        self.mock_get_etag = etag_patcher.start()
+        self.addCleanup(etag_patcher.stop)
+
     @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
     @patch('src.download.download_file')
     @patch('src.ocr.extract_text')
@@ -83,6 +94,534 @@ class TestHandler(unittest.TestCase):
         mock_format_sqs.assert_called_once_with(mock_processed_result, test_request_id, test_s3_key)
         mock_send_to_queue.assert_called_once_with(mock_final_message)
 
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_multiple_records_and_images(self, mock_download, mock_extract_text, mock_convert,
+                                                          mock_extract_info, mock_process_data, mock_format_sqs,
+                                                          mock_send_batch, mock_upload):
+        """複数レコード・複数画像が並行処理され、結果がレコード/画像の順に返ることをテスト"""
+        mock_download.side_effect = lambda bucket, key: key.encode()
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info.return_value = {"issuer_name": {"value": "テスト株式会社"}}
+        mock_process_data.return_value = {"processed": True, "corrected_data": {}}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": []}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{m['clipping_request_id']}" for m in messages]
+
+        from handler import process_document
+
+        event = {
+            "Records": [
+                {
+                    "messageId": "sqs-1",
+                    "body": json.dumps({
+                        "clipping_request_id": "req-1",
+                        "images": [{"index": 1, "s3_key": "a.png"}, {"index": 2, "s3_key": "b.png"}]
+                    })
+                },
+                {
+                    "messageId": "sqs-2",
+                    "body": json.dumps({
+                        "clipping_request_id": "req-2",
+                        "images": [{"index": 1, "s3_key": "c.png"}]
+                    })
+                }
+            ]
+        }
+
+        response = process_document(event, {})
+
+        self.assertEqual(response["statusCode"], 200)
+        results = json.loads(response["body"])["results"]
+        self.assertEqual([r["file"] for r in results], ["a.png", "b.png", "c.png"])
+        self.assertEqual([r["message_id"] for r in results], ["msg-req-1", "msg-req-1", "msg-req-2"])
+        self.assertEqual(mock_download.call_count, 3)
+        # OCRはレコードごとに1回のバッチ呼び出しにまとめられる
+        self.assertEqual(mock_extract_text.call_count, 2)
+        self.assertEqual(mock_extract_info.call_count, 3)
+        # SQSへの送信は1回のバッチ送信にまとめられる
+        mock_send_batch.assert_called_once()
+        self.assertEqual(len(mock_send_batch.call_args[0][0]), 3)
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_reports_failed_records(self, mock_download, mock_extract_text, mock_convert,
+                                                     mock_extract_info, mock_process_data, mock_format_sqs,
+                                                     mock_send_batch, mock_upload):
+        """エラーが発生したレコードのみ batchItemFailures として返されることをテスト"""
+        def download(bucket, key):
+            if key == "broken.png":
+                raise RuntimeError("S3 error")
+            return key.encode()
+
+        mock_download.side_effect = download
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info.return_value = {}
+        mock_process_data.return_value = {"processed": True, "corrected_data": {}}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": []}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{i}" for i in range(len(messages))]
+
+        from handler import process_document
+
+        event = {
+            "Records": [
+                {
+                    "messageId": "sqs-1",
+                    "body": json.dumps({
+                        "clipping_request_id": "req-1",
+                        "images": [{"index": 1, "s3_key": "broken.png"}]
+                    })
+                },
+                {
+                    "messageId": "sqs-2",
+                    "body": json.dumps({
+                        "clipping_request_id": "req-2",
+                        "images": [{"index": 1, "s3_key": "a.png"}]
+                    })
+                }
+            ]
+        }
+
+        response = process_document(event, {})
+
+        self.assertEqual(response["batchItemFailures"], [{"itemIdentifier": "sqs-1"}])
+        self.assertEqual([r["file"] for r in json.loads(response["body"])["results"]], ["a.png"])
+        # 成功したレコードの結果は送信される
+        mock_send_batch.assert_called_once()
+        self.assertEqual(len(mock_send_batch.call_args[0][0]), 1)
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_reports_cancelled_records(self, mock_download, mock_extract_text, mock_convert,
+                                                        mock_extract_info, mock_process_data, mock_format_sqs,
+                                                        mock_send_batch, mock_upload):
+        """Exceptionを継承しない例外 (CancelledError) で終了したレコードも batchItemFailures として返されることをテスト"""
+        def download(bucket, key):
+            if key == "cancelled.png":
+                raise asyncio.CancelledError()
+            return key.encode()
+
+        mock_download.side_effect = download
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info.return_value = {}
+        mock_process_data.return_value = {"processed": True, "corrected_data": {}}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": []}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{i}" for i in range(len(messages))]
+
+        from handler import process_document
+
+        event = {"Records": [
+            {"messageId": "sqs-1", "body": json.dumps({"clipping_request_id": "req-1",
+                                                        "images": [{"index": 1, "s3_key": "cancelled.png"}]})},
+            {"messageId": "sqs-2", "body": json.dumps({"clipping_request_id": "req-2",
+                                                        "images": [{"index": 1, "s3_key": "a.png"}]})},
+        ]}
+
+        response = process_document(event, {})
+
+        self.assertEqual(response["batchItemFailures"], [{"itemIdentifier": "sqs-1"}])
+        self.assertEqual([r["file"] for r in json.loads(response["body"])["results"]], ["a.png"])
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_reports_records_with_unsent_messages(self, mock_download, mock_extract_text, mock_convert,
+                                                                   mock_extract_info, mock_process_data, mock_format_sqs,
+                                                                   mock_send_batch, mock_upload):
+        """SQSへ送信できなかったメッセージのレコードのみ batchItemFailures として返されることをテスト"""
+        mock_download.side_effect = lambda bucket, key: key.encode()
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info.return_value = {}
+        mock_process_data.return_value = {"processed": True, "corrected_data": {}}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "key": key}
+        # req-2 の2枚目の画像のメッセージのみ送信に失敗する
+        mock_send_batch.side_effect = lambda messages: [
+            None if m["key"] == "c.png" else f"msg-{m['key']}" for m in messages
+        ]
+
+        from handler import process_document
+
+        event = {"Records": [
+            {"messageId": "sqs-1", "body": json.dumps({"clipping_request_id": "req-1",
+                                                        "images": [{"index": 1, "s3_key": "a.png"}]})},
+            {"messageId": "sqs-2", "body": json.dumps({"clipping_request_id": "req-2",
+                                                        "images": [{"index": 1, "s3_key": "b.png"},
+                                                                   {"index": 2, "s3_key": "c.png"}]})},
+        ]}
+
+        response = process_document(event, {})
+
+        # 例外で全レコードを再配信させず、送信できなかったメッセージのレコードのみ再配信させる
+        self.assertEqual(response["batchItemFailures"], [{"itemIdentifier": "sqs-2"}])
+        results = json.loads(response["body"])["results"]
+        self.assertEqual([(r["file"], r["message_id"]) for r in results], [("a.png", "msg-a.png")])
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_reuses_cached_ocr_results(self, mock_download, mock_extract_text, mock_convert,
+                                                        mock_extract_info, mock_process_data, mock_format_sqs,
+                                                        mock_send_batch, mock_upload):
+        """同じETagのオブジェクトはダウンロードとOCRが省略されることをテスト"""
+        mock_download.side_effect = lambda bucket, key: key.encode()
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info.return_value = {}
+        mock_process_data.return_value = {"processed": True, "corrected_data": {}}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": []}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{i}" for i in range(len(messages))]
+
+        from handler import process_document
+
+        event = {
+            "Records": [
+                {
+                    "messageId": "sqs-1",
+                    "body": json.dumps({
+                        "clipping_request_id": "req-1",
+                        "images": [{"index": 1, "s3_key": "a.png"}, {"index": 2, "s3_key": "a.png"}]
+                    })
+                }
+            ]
+        }
+
+        process_document(event, {})
+        # レコード内の重複したキーは1回だけダウンロードされる
+        self.assertEqual(mock_download.call_count, 1)
+
+        response = process_document(event, {})
+
+        # 2回目の呼び出しではキャッシュが使われる
+        self.assertEqual(mock_download.call_count, 1)
+        self.assertEqual(mock_extract_text.call_count, 1)
+        self.assertEqual(mock_extract_info.call_count, 4)
+        self.assertEqual([r["file"] for r in json.loads(response["body"])["results"]], ["a.png", "a.png"])
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_reuses_ocr_results_for_identical_content(self, mock_download, mock_extract_text, mock_convert,
+                                                                       mock_extract_info, mock_process_data, mock_format_sqs,
+                                                                       mock_send_batch, mock_upload):
+        """キーが異なっても内容が同じファイルはOCRが省略されることをテスト"""
+        mock_download.return_value = b"same content"
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info.return_value = {}
+        mock_process_data.return_value = {"processed": True, "corrected_data": {}}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": []}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{i}" for i in range(len(messages))]
+
+        from handler import process_document
+
+        def make_event(keys):
+            return {"Records": [{
+                "messageId": "sqs-1",
+                "body": json.dumps({"clipping_request_id": "req-1",
+                                    "images": [{"index": i, "s3_key": key} for i, key in enumerate(keys)]})
+            }]}
+
+        process_document(make_event(["a.png", "b.png"]), {})
+        # レコード内で内容が同じファイルは1回だけOCRされる
+        self.assertEqual(mock_download.call_count, 2)
+        mock_extract_text.assert_called_once()
+        self.assertEqual(len(mock_extract_text.call_args[0][0]), 1)
+
+        response = process_document(make_event(["c.png"]), {})
+
+        # 別のキーでも内容が同じ場合はキャッシュが使われる
+        self.assertEqual(mock_download.call_count, 3)
+        mock_extract_text.assert_called_once()
+        self.assertEqual(mock_extract_info.call_count, 3)
+        self.assertEqual(len(json.loads(response["body"])["results"]), 1)
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_starts_download_before_other_etags(self, mock_download, mock_extract_text, mock_convert,
+                                                                 mock_extract_info, mock_process_data, mock_format_sqs,
+                                                                 mock_send_batch, mock_upload):
+        """他の画像のETag取得を待たずに、キャッシュにない画像のダウンロードが開始されることをテスト"""
+        a_downloaded = threading.Event()
+
+        def get_etag(bucket, key):
+            # b.png のETag取得は a.png のダウンロード開始まで完了しない
+            if key == "b.png":
+                self.assertTrue(a_downloaded.wait(timeout=5))
+            return f'"etag-{key}"'
+
+        def download(bucket, key):
+            if key == "a.png":
+                a_downloaded.set()
+            return key.encode()
+
+        self.mock_get_etag.side_effect = get_etag
+        mock_download.side_effect = download
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info.return_value = {}
+        mock_process_data.return_value = {"processed": True, "corrected_data": {}}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": []}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{i}" for i in range(len(messages))]
+
+        from handler import process_document
+
+        event = {
+            "Records": [{
+                "messageId": "sqs-1",
+                "body": json.dumps({
+                    "clipping_request_id": "req-1",
+                    "images": [{"index": 1, "s3_key": "a.png"}, {"index": 2, "s3_key": "b.png"}]
+                })
+            }]
+        }
+
+        response = process_document(event, {})
+
+        self.assertEqual(response["batchItemFailures"], [])
+        # OCRにはHEADの完了順によらず画像の順に渡される
+        self.assertEqual([key for _, key in mock_extract_text.call_args[0][0]], ["a.png", "b.png"])
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.LLM_BATCH_SIZE', 4)
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information_batch')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_batches_llm_requests(self, mock_download, mock_extract_text, mock_convert,
+                                                   mock_extract_info_batch, mock_process_data, mock_format_sqs,
+                                                   mock_send_batch, mock_upload):
+        """LLM_BATCH_SIZEが2以上の場合、レコードをまたいでLLMへのリクエストがまとめられることをテスト"""
+        mock_download.side_effect = lambda bucket, key: key.encode()
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info_batch.side_effect = lambda texts: [{"source": text["text"]} for text in texts]
+        mock_process_data.side_effect = lambda info, ocr, request_id, key: {"processed": True, "corrected_data": info}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": [data]}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{i}" for i in range(len(messages))]
+
+        from handler import process_document
+
+        event = {
+            "Records": [
+                {
+                    "messageId": "sqs-1",
+                    "body": json.dumps({
+                        "clipping_request_id": "req-1",
+                        "images": [{"index": 1, "s3_key": "a.png"}, {"index": 2, "s3_key": "b.png"}]
+                    })
+                },
+                {
+                    "messageId": "sqs-2",
+                    "body": json.dumps({
+                        "clipping_request_id": "req-2",
+                        "images": [{"index": 1, "s3_key": "c.png"}]
+                    })
+                }
+            ]
+        }
+
+        response = process_document(event, {})
+
+        self.assertEqual(response["batchItemFailures"], [])
+        mock_extract_info_batch.assert_called_once()
+        self.assertEqual(len(mock_extract_info_batch.call_args[0][0]), 3)
+        # 抽出結果はそれぞれの画像に対応付けられる
+        sent = mock_send_batch.call_args[0][0]
+        self.assertEqual([m["clips"][0]["corrected_data"]["source"] for m in sent], ["a.png", "b.png", "c.png"])
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url'})
+    @patch('handler.LLM_BATCH_SIZE', 4)
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.extract_information_batch')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_falls_back_when_llm_batch_fails(self, mock_download, mock_extract_text, mock_convert,
+                                                              mock_extract_info_batch, mock_extract_info, mock_process_data,
+                                                              mock_format_sqs, mock_send_batch, mock_upload):
+        """まとめたLLMリクエストが失敗した場合、画像ごとのリクエストにフォールバックすることをテスト"""
+        mock_download.side_effect = lambda bucket, key: key.encode()
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info_batch.side_effect = Exception("Batch LLM Error")
+        mock_extract_info.side_effect = lambda text: {"source": text["text"]}
+        mock_process_data.side_effect = lambda info, ocr, request_id, key: {"processed": True, "corrected_data": info}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": [data]}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{i}" for i in range(len(messages))]
+
+        from handler import process_document
+
+        event = {
+            "Records": [{
+                "messageId": "sqs-1",
+                "body": json.dumps({
+                    "clipping_request_id": "req-1",
+                    "images": [{"index": 1, "s3_key": "a.png"}, {"index": 2, "s3_key": "b.png"}]
+                })
+            }]
+        }
+
+        response = process_document(event, {})
+
+        self.assertEqual(response["batchItemFailures"], [])
+        mock_extract_info_batch.assert_called_once()
+        self.assertEqual(mock_extract_info.call_count, 2)
+        sent = mock_send_batch.call_args[0][0]
+        self.assertEqual([m["clips"][0]["corrected_data"]["source"] for m in sent], ["a.png", "b.png"])
+
+    @patch.dict(os.environ, {'S3_BUCKET_NAME': 'test-bucket', 'OUTPUT_QUEUE_URL': 'test-queue-url',
+                             'LLM_OUTPUT_S3_BUCKET_NAME': 'llm-output-bucket'})
+    @patch('handler.upload_to_s3')
+    @patch('handler.send_batch_to_queue')
+    @patch('handler.format_sqs_message')
+    @patch('handler.process_extracted_data')
+    @patch('handler.extract_information')
+    @patch('handler.convert_bounding_box_format')
+    @patch('handler.extract_text_batch')
+    @patch('handler.download_bytes')
+    def test_process_document_uploads_llm_output(self, mock_download, mock_extract_text, mock_convert,
+                                                 mock_extract_info, mock_process_data, mock_format_sqs,
+                                                 mock_send_batch, mock_upload):
+        """LLM_OUTPUT_S3_BUCKET_NAMEが設定されている場合、画像ごとのLLM処理結果がS3にアップロードされることをテスト"""
+        mock_download.side_effect = lambda bucket, key: key.encode()
+        mock_extract_text.side_effect = lambda files: [create_mock_ocr_response(key) for _, key in files]
+        mock_convert.side_effect = lambda ocr: {"text": ocr.full_text_annotation.text}
+        mock_extract_info.return_value = {"title": "請求書"}
+        mock_process_data.return_value = {"processed": True, "corrected_data": {}}
+        mock_format_sqs.side_effect = lambda data, request_id, key: {"clipping_request_id": request_id, "clips": []}
+        mock_send_batch.side_effect = lambda messages: [f"msg-{i}" for i in range(len(messages))]
+
+        from handler import process_document
+
+        event = {
+            "Records": [{
+                "messageId": "sqs-1",
+                "body": json.dumps({
+                    "clipping_request_id": "req-1",
+                    "images": [{"index": 1, "s3_key": "a.png"}, {"index": 2, "s3_key": "b.png"}]
+                })
+            }]
+        }
+
+        process_document(event, {})
+
+        self.assertEqual(sorted(call.args[2] for call in mock_upload.call_args_list),
+                         ["req-1/a.png_combined_output.json", "req-1/b.png_combined_output.json"])
+        data, bucket, _ = mock_upload.call_args_list[0].args
+        self.assertEqual(bucket, "llm-output-bucket")
+        self.assertEqual(json.loads(data)["llm_output"], {"title": "請求書"})
+
+        # 圧縮を有効にした場合はgzipで圧縮し、Content-Encodingを指定する
+        mock_upload.reset_mock()
+        with patch('handler.LLM_OUTPUT_COMPRESSION', 'gzip'):
+            process_document(event, {})
+
+        data, bucket, _ = mock_upload.call_args_list[0].args
+        self.assertEqual(mock_upload.call_args_list[0].kwargs, {"content_encoding": "gzip"})
+        self.assertEqual(json.loads(gzip.decompress(data))["llm_output"], {"title": "請求書"})
+
+    def test_message_body_decoder(self):
+        """SQSメッセージ本文のデコードと型検証をテスト"""
+        import msgspec
+        from handler import _MESSAGE_BODY_DECODER
+
+        body = _MESSAGE_BODY_DECODER.decode(json.dumps({
+            "clipping_request_id": "req-1",
+            "images": [{"s3_key": "a.png", "index": 2}, {"s3_key": "b.png"}, {"index": 3}],
+            "unknown_field": True
+        }))
+        self.assertEqual(body.clipping_request_id, "req-1")
+        self.assertEqual([(i.s3_key, i.index) for i in body.images], [("a.png", 2), ("b.png", "N/A"), (None, 3)])
+
+        self.assertEqual(_MESSAGE_BODY_DECODER.decode("{}").images, [])
+        with self.assertRaises(msgspec.ValidationError):
+            _MESSAGE_BODY_DECODER.decode(json.dumps({"images": "a.png"}))
+
+    def test_decode_message_body_accepts_dict(self):
+        """本文が既に辞書の場合もデコードと同じ型検証が行われることをテスト"""
+        import msgspec
+        from handler import _decode_message_body
+
+        body = _decode_message_body({"clipping_request_id": "req-1", "images": [{"s3_key": "a.png"}], "unknown_field": True})
+        self.assertEqual(body.clipping_request_id, "req-1")
+        self.assertEqual([(i.s3_key, i.index) for i in body.images], [("a.png", "N/A")])
+
+        self.assertEqual(_decode_message_body(b'{"images": []}').images, [])
+        with self.assertRaises(msgspec.DecodeError):
+            _decode_message_body({"images": "a.png"})
+
+    @patch('handler.prewarm_generative_model')
+    @patch('handler.get_vision_client')
+    @patch('handler.get_sqs_client')
+    @patch('handler.get_s3_client')
+    def test_prewarm_clients_ignores_errors(self, mock_s3, mock_sqs, mock_vision, mock_prewarm_model):
+        """事前作成に失敗しても例外が送出されないことをテスト"""
+        from handler import _prewarm_clients
+
+        _prewarm_clients()
+        mock_prewarm_model.assert_called_once()
+
+        mock_vision.side_effect = Exception("Auth Error")
+        _prewarm_clients()
+        self.assertEqual(mock_prewarm_model.call_count, 1)
+
     # TODO: エラーケースや複数画像、OCR失敗などのテストケースを追加
 
 if __name__ == '__main__':
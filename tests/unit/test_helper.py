@@ -0,0 +1,65 @@
+import unittest
+from google.cloud import vision
+from src.utils.helper import convert_bounding_box_format, _process_element_to_dict
+
+
+class TestHelper(unittest.TestCase):
+
+    def test_convert_text_annotations_matches_element_conversion(self):
+        """textAnnotationsの一括変換結果が要素ごとの変換結果と一致することをテスト"""
+        response = vision.AnnotateImageResponse(text_annotations=[
+            {"description": "請求書", "locale": "ja",
+             "bounding_poly": {"vertices": [{"x": 10, "y": 20}, {"x": 60, "y": 20}, {"x": 60, "y": 40}, {"x": 10, "y": 40}]}},
+            # 幅・高さが負になる場合は0にする
+            {"description": "逆向き",
+             "bounding_poly": {"vertices": [{"x": 50, "y": 30}, {"x": 40, "y": 30}, {"x": 40, "y": 10}, {"x": 50, "y": 10}]}},
+            # 頂点が4つでない場合はBBを持たない
+            {"description": "三角", "bounding_poly": {"vertices": [{"x": 1}, {"x": 2}, {"x": 3}]}},
+            {"description": "BBなし"},
+        ])
+
+        result = convert_bounding_box_format(response)
+
+        expected = [_process_element_to_dict(annotation) for annotation in response.text_annotations]
+        self.assertEqual(result["textAnnotations"], expected)
+        self.assertEqual(result["textAnnotations"][0]["simple_bounding_box"], {"x": 10, "y": 20, "width": 50, "height": 20})
+        self.assertEqual(result["textAnnotations"][1]["simple_bounding_box"], {"x": 50, "y": 30, "width": 0, "height": 0})
+        self.assertNotIn("simple_bounding_box", result["textAnnotations"][2])
+        self.assertNotIn("simple_bounding_box", result["textAnnotations"][3])
+
+    def test_convert_full_text_annotation(self):
+        """fullTextAnnotationが階層的な辞書に変換されることをテスト"""
+        response = vision.AnnotateImageResponse(full_text_annotation={
+            "text": "請求",
+            "pages": [{
+                "width": 100, "height": 200,
+                "blocks": [{
+                    "confidence": 0.5,
+                    "paragraphs": [{
+                        "confidence": 0.25,
+                        "words": [{"confidence": 0.75, "symbols": [{"text": "請", "confidence": 0.5}, {"text": "求"}]}]
+                    }]
+                }]
+            }]
+        })
+
+        result = convert_bounding_box_format(response)
+
+        self.assertNotIn("textAnnotations", result)
+        self.assertEqual(result["fullTextAnnotation"], {
+            "text": "請求",
+            "pages": [{
+                "width": 100, "height": 200,
+                "blocks": [{
+                    "confidence": 0.5,
+                    "paragraphs": [{
+                        "confidence": 0.25,
+                        "words": [{"confidence": 0.75, "symbols": [{"text": "請", "confidence": 0.5}, {"text": "求", "confidence": 0.0}]}]
+                    }]
+                }]
+            }]
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,13 +2,19 @@ import unittest
 import json
 import os
 from unittest.mock import patch, MagicMock
-from src.llm import extract_information
+import src.llm
+from src.llm import extract_information, extract_information_batch
 
 
 class TestLLM(unittest.TestCase):
 
     def setUp(self):
         """テストごとに実行される初期化処理"""
+        # プロセス内でキャッシュされるVertex AIの初期化状態をリセット
+        src.llm._vertexai_initialized_location = None
+        src.llm._generative_model = None
+        src.llm._user_prompt_template = None
+        src.llm._llm_response_cache.clear()
         self.test_text = "請求書\n株式会社テスト\n合計金額: 10,000円\n税込"
         self.sample_system_prompt = "あなたは請求書から情報を抽出する専門家です。"
         self.sample_user_prompt = "以下のJSONから重要な情報を抽出してください:\n{text}"
@@ -379,6 +385,69 @@ class TestLLM(unittest.TestCase):
             mock_get_prompt.assert_any_call('system')
             mock_get_prompt.assert_any_call('user')
 
+    @patch('src.llm.get_prompt_template')
+    def test_extract_information_caches_parsed_responses(self, mock_get_prompt):
+        """同じテキストの再処理ではキャッシュした応答が使われ、パースできない応答はキャッシュされないことをテスト"""
+        mock_get_prompt.side_effect = [self.sample_system_prompt, self.sample_user_prompt]
+
+        with patch('src.llm.vertexai'), \
+             patch('src.llm.GenerativeModel') as mock_generative_model, \
+             patch('src.llm.logger'):
+            valid_response = MagicMock()
+            valid_response.text = '{"test": "response"}'
+            invalid_response = MagicMock()
+            invalid_response.text = 'not json'
+            mock_model_instance = MagicMock()
+            mock_model_instance.generate_content.side_effect = [valid_response, invalid_response, invalid_response]
+            mock_generative_model.return_value = mock_model_instance
+
+            first = extract_information(self.test_text)
+            first["test"] = "changed"
+            second = extract_information(self.test_text)
+            self.assertEqual(second["test"], "response")
+            # キャッシュした応答ではトークンを使用していない
+            self.assertEqual(second["usage_metadata"], {
+                "prompt_token_count": 0, "candidates_token_count": 0, "total_token_count": 0, "cached": True
+            })
+            self.assertNotIn("cached", first["usage_metadata"])
+            self.assertEqual(mock_model_instance.generate_content.call_count, 1)
+
+            extract_information("other text")
+            result = extract_information("other text")
+            self.assertEqual(result["raw_response"], "not json")
+            self.assertEqual(mock_model_instance.generate_content.call_count, 3)
+
+    def test_loads_json_falls_back_to_stdlib_json(self):
+        """orjsonでパースできないNaNなどを含む応答も標準のjsonでパースされることをテスト"""
+        self.assertEqual(src.llm._loads_json('{"a": [1, 2]}'), {"a": [1, 2]})
+        result = src.llm._loads_json('{"a": NaN, "b": 123456789012345678901234567890}')
+        self.assertNotEqual(result["a"], result["a"])
+        self.assertEqual(result["b"], 123456789012345678901234567890)
+        with self.assertRaises(json.JSONDecodeError):
+            src.llm._loads_json('{"a": ')
+
+    @patch('src.llm.get_prompt_template')
+    def test_prompt_templates_are_loaded_once(self, mock_get_prompt):
+        """ウォームスタート時にプロンプトテンプレートを読み込み直さないことをテスト"""
+        mock_get_prompt.side_effect = [self.sample_system_prompt, self.sample_user_prompt]
+
+        with patch('src.llm.vertexai'), \
+             patch('src.llm.GenerativeModel') as mock_generative_model, \
+             patch('src.llm.logger'):
+            mock_response = MagicMock()
+            mock_response.text = '{"test": "response"}'
+            mock_model_instance = MagicMock()
+            mock_model_instance.generate_content.return_value = mock_response
+            mock_generative_model.return_value = mock_model_instance
+
+            extract_information(self.test_text)
+            extract_information("別の請求書")
+
+            self.assertEqual(mock_get_prompt.call_count, 2)
+            mock_generative_model.assert_called_once()
+            self.assertEqual(mock_model_instance.generate_content.call_args_list[1].args[0],
+                             self.sample_user_prompt.format(text="別の請求書"))
+
     @patch('src.llm.vertexai')
     @patch('src.llm.GenerativeModel')
     @patch('src.llm.get_prompt_template')
@@ -403,5 +472,58 @@ class TestLLM(unittest.TestCase):
             extract_information(self.test_text)
 
 
+    @patch('src.llm.vertexai')
+    @patch('src.llm.GenerativeModel')
+    @patch('src.llm.get_prompt_template')
+    @patch('src.llm.logger')
+    def test_extract_information_reuses_model(self, mock_logger, mock_get_prompt, mock_generative_model, mock_vertexai):
+        """2回目以降の呼び出しでGeminiモデルが再利用されることをテスト"""
+        mock_get_prompt.side_effect = lambda prompt_type: (
+            self.sample_system_prompt if prompt_type == 'system' else self.sample_user_prompt
+        )
+        mock_response = MagicMock()
+        mock_response.text = '{"test": "response"}'
+        mock_model_instance = MagicMock()
+        mock_model_instance.generate_content.return_value = mock_response
+        mock_generative_model.return_value = mock_model_instance
+
+        extract_information(self.test_text)
+        extract_information("別の請求書")
+
+        mock_generative_model.assert_called_once()
+        self.assertEqual(mock_model_instance.generate_content.call_count, 2)
+        mock_vertexai.init.assert_called_once()
+
+    @patch('src.llm.vertexai')
+    @patch('src.llm.GenerativeModel')
+    @patch('src.llm.get_prompt_template')
+    @patch('src.llm.logger')
+    def test_extract_information_batch(self, mock_logger, mock_get_prompt, mock_generative_model, mock_vertexai):
+        """複数書類が1回のリクエストで抽出され、応答にない書類は個別に抽出されることをテスト"""
+        mock_get_prompt.side_effect = lambda prompt_type: (
+            self.sample_system_prompt if prompt_type == 'system' else self.sample_user_prompt
+        )
+        batch_response = MagicMock()
+        batch_response.text = json.dumps({"0": {"issuer_name": {"value": "A社"}}, "2": {"issuer_name": {"value": "C社"}}})
+        single_response = MagicMock()
+        single_response.text = json.dumps({"issuer_name": {"value": "B社"}})
+        mock_model_instance = MagicMock()
+        mock_model_instance.generate_content.side_effect = [batch_response, single_response]
+        mock_generative_model.return_value = mock_model_instance
+
+        results = extract_information_batch([{"doc": "a"}, {"doc": "b"}, {"doc": "c"}])
+
+        self.assertEqual([r["issuer_name"]["value"] for r in results], ["A社", "B社", "C社"])
+        self.assertEqual(results[0]["usage_metadata"]["batch_size"], 3)
+        # バッチ全体の使用量は書類ごとの使用量とは別のキーで、結果ごとに別の辞書として記録される
+        self.assertEqual(results[0]["usage_metadata"], results[2]["usage_metadata"])
+        self.assertIsNot(results[0]["usage_metadata"], results[2]["usage_metadata"])
+        self.assertIn("batch_total_token_count", results[0]["usage_metadata"])
+        self.assertNotIn("total_token_count", results[0]["usage_metadata"])
+        batch_prompt = mock_model_instance.generate_content.call_args_list[0][0][0]
+        self.assertIn('<doc id="0">', batch_prompt)
+        self.assertIn('<doc id="2">', batch_prompt)
+        self.assertEqual(mock_model_instance.generate_content.call_count, 2)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,256 @@
+import unittest
+import io
+from unittest.mock import patch, MagicMock
+from botocore.exceptions import ClientError
+from google.cloud import vision
+from src.ocr import extract_text_batch, extract_ocr_data_from_pdf_bytes, _render_pdf_pages, _pdf_render_lock, _load_cached_response, VISION_BATCH_MAX_IMAGES
+
+
+def _text_response(text):
+    return vision.AnnotateImageResponse(full_text_annotation={"text": text})
+
+
+class TestOcr(unittest.TestCase):
+
+    @patch('src.ocr._render_pdf_pages')
+    @patch('src.ocr.get_vision_client')
+    def test_extract_text_batch_includes_pdf_pages(self, mock_get_client, mock_render):
+        """PDFのページが画像と同じbatch_annotate_imagesのリクエストにまとめられることをテスト"""
+        mock_render.return_value = [b"page1", b"page2"]
+        mock_client = MagicMock()
+        mock_client.batch_annotate_images.return_value = vision.BatchAnnotateImagesResponse(responses=[
+            _text_response("画像"),
+            _text_response("1ページ目"),
+            vision.AnnotateImageResponse(error={"message": "page error"}),
+            vision.AnnotateImageResponse(),
+        ])
+        mock_get_client.return_value = mock_client
+
+        result = extract_text_batch([(b"image", "a.png"), (b"pdf", "b.pdf"), (b"empty", "c.jpg")])
+
+        mock_client.batch_annotate_images.assert_called_once()
+        requests = mock_client.batch_annotate_images.call_args.kwargs["requests"]
+        self.assertEqual([r.image.content for r in requests], [b"image", b"page1", b"page2", b"empty"])
+        self.assertEqual(result[0].full_text_annotation.text, "画像")
+        # エラーのページは除外され、PDFの結果はページごとのリストになる
+        self.assertEqual([r.full_text_annotation.text for r in result[1]], ["1ページ目"])
+        self.assertIsNone(result[2])
+
+    @patch('src.ocr.get_vision_client')
+    def test_extract_text_batch_raises_on_image_error(self, mock_get_client):
+        """画像のOCRでエラーが返された場合に例外が送出されることをテスト"""
+        mock_client = MagicMock()
+        mock_client.batch_annotate_images.return_value = vision.BatchAnnotateImagesResponse(responses=[
+            vision.AnnotateImageResponse(error={"message": "image error"}),
+        ])
+        mock_get_client.return_value = mock_client
+
+        with self.assertRaises(Exception):
+            extract_text_batch([(b"image", "a.png")])
+
+
+    @patch('src.ocr.get_vision_client')
+    def test_extract_text_batch_sends_multiple_batches_in_order(self, mock_get_client):
+        """1リクエストに収まらない画像が複数のリクエストで送信され、入力と同じ順序で結果が返されることをテスト"""
+        mock_client = MagicMock()
+        mock_client.batch_annotate_images.side_effect = lambda requests: vision.BatchAnnotateImagesResponse(
+            responses=[_text_response(r.image.content.decode()) for r in requests])
+        mock_get_client.return_value = mock_client
+        files = [(f"image{i}".encode(), f"{i}.png") for i in range(VISION_BATCH_MAX_IMAGES * 2 + 1)]
+
+        result = extract_text_batch(files)
+
+        self.assertEqual(mock_client.batch_annotate_images.call_count, 3)
+        self.assertEqual([r.full_text_annotation.text for r in result], [f"image{i}" for i in range(len(files))])
+
+    @patch('src.ocr.OCR_RESULT_CACHE_BUCKET', 'cache-bucket')
+    @patch('src.ocr.get_s3_client')
+    @patch('src.ocr.get_vision_client')
+    def test_extract_text_batch_reuses_results_stored_in_s3(self, mock_get_client, mock_get_s3_client):
+        """S3に保存済みの画像はVision APIに送信されず、新しい結果がS3に保存されることをテスト"""
+        stored = {}
+
+        def get_object(Bucket, Key):
+            if Key not in stored:
+                raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+            return {"Body": io.BytesIO(stored[Key])}
+
+        mock_s3_client = MagicMock()
+        mock_s3_client.get_object.side_effect = get_object
+        mock_s3_client.put_object.side_effect = lambda Bucket, Key, Body: stored.__setitem__(Key, Body)
+        mock_get_s3_client.return_value = mock_s3_client
+        mock_client = MagicMock()
+        mock_client.batch_annotate_images.side_effect = lambda requests: vision.BatchAnnotateImagesResponse(
+            responses=[_text_response(r.image.content.decode()) for r in requests])
+        mock_get_client.return_value = mock_client
+
+        extract_text_batch([(b"image1", "1.png")])
+        result = extract_text_batch([(b"image1", "a.png"), (b"image2", "b.png")])
+
+        self.assertEqual([r.full_text_annotation.text for r in result], ["image1", "image2"])
+        self.assertEqual(mock_client.batch_annotate_images.call_count, 2)
+        # 2回目のリクエストには保存されていない画像だけが含まれる
+        second_requests = mock_client.batch_annotate_images.call_args.kwargs["requests"]
+        self.assertEqual([r.image.content for r in second_requests], [b"image2"])
+        self.assertEqual(len(stored), 2)
+
+    @patch('src.ocr.OCR_RESULT_CACHE_BUCKET', 'cache-bucket')
+    @patch('src.ocr.logger')
+    @patch('src.ocr.get_s3_client')
+    def test_load_cached_response_treats_access_denied_as_miss(self, mock_get_s3_client, mock_logger):
+        """s3:ListBucket権限がない場合のAccessDeniedは警告を出さずにキャッシュミスとして扱われることをテスト"""
+        mock_s3_client = MagicMock()
+        mock_get_s3_client.return_value = mock_s3_client
+
+        for code in ("NoSuchKey", "AccessDenied"):
+            mock_s3_client.get_object.side_effect = ClientError({"Error": {"Code": code}}, "GetObject")
+            self.assertIsNone(_load_cached_response("ocr-cache/key.pb"))
+        mock_logger.warning.assert_not_called()
+
+        # それ以外のエラーは警告を出してキャッシュミスとして扱う
+        mock_s3_client.get_object.side_effect = ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+        self.assertIsNone(_load_cached_response("ocr-cache/key.pb"))
+        mock_s3_client.get_object.side_effect = ValueError("broken")
+        self.assertIsNone(_load_cached_response("ocr-cache/key.pb"))
+        self.assertEqual(mock_logger.warning.call_count, 2)
+
+    @patch('src.ocr._render_pdf_pages')
+    @patch('src.ocr.get_vision_client')
+    def test_extract_ocr_data_from_pdf_bytes_batches_pages(self, mock_get_client, mock_render):
+        """PDFの全ページが1回のbatch_annotate_imagesでOCRされることをテスト"""
+        mock_render.return_value = [b"page1", b"page2", b"page3"]
+        mock_client = MagicMock()
+        mock_client.batch_annotate_images.return_value = vision.BatchAnnotateImagesResponse(responses=[
+            _text_response("1ページ目"),
+            vision.AnnotateImageResponse(error={"message": "page error"}),
+            _text_response("3ページ目"),
+        ])
+        mock_get_client.return_value = mock_client
+
+        result = extract_ocr_data_from_pdf_bytes(b"pdf", "a.pdf", max_pages=3)
+
+        mock_client.batch_annotate_images.assert_called_once()
+        mock_client.document_text_detection.assert_not_called()
+        self.assertEqual([r.full_text_annotation.text for r in result], ["1ページ目", "3ページ目"])
+
+    def test_render_pdf_pages_image_format(self):
+        """PDFのページがPDF_PAGE_IMAGE_FORMATで指定した形式の画像に変換されることをテスト"""
+        import fitz
+        document = fitz.open()
+        document.new_page().insert_text((72, 72), "invoice")
+        document.new_page()
+        content = document.tobytes()
+
+        pages = _render_pdf_pages(content, "a.pdf", max_pages=5)
+        self.assertEqual(len(pages), 2)
+        self.assertTrue(pages[0].startswith(b"\x89PNG"))
+
+        with patch('src.ocr.PDF_PAGE_IMAGE_FORMAT', "jpeg"):
+            pages = _render_pdf_pages(content, "a.pdf")
+        self.assertEqual(len(pages), 1)
+        self.assertTrue(pages[0].startswith(b"\xff\xd8"))
+
+    def test_render_pdf_pages_grayscale_and_max_dimension(self):
+        """PDFのページがグレースケールで変換され、長辺がPDF_PAGE_MAX_DIMENSIONに収まることをテスト"""
+        import fitz
+        document = fitz.open()
+        document.new_page(width=2000, height=1000)
+        content = document.tobytes()
+
+        with patch('src.ocr.PDF_PAGE_MAX_DIMENSION', 1000), patch('src.ocr.PDF_PAGE_GRAYSCALE', True):
+            pix = fitz.Pixmap(_render_pdf_pages(content, "a.pdf")[0])
+        self.assertEqual((pix.width, pix.height), (1000, 500))
+        self.assertEqual(pix.n, 1)
+
+        # デフォルトではRGBで変換する
+        pix = fitz.Pixmap(_render_pdf_pages(content, "a.pdf", dpi=36)[0])
+        self.assertEqual((pix.width, pix.height), (1000, 500))
+        self.assertEqual(pix.n, 3)
+
+    @patch('src.ocr.get_vision_client')
+    def test_extract_text_batch_keeps_150dpi_coordinates_for_large_pages(self, mock_get_client):
+        """デフォルトでは大きな用紙 (A3) のページも150DPIで変換され、OCRの座標が150DPIの画素座標になることをテスト"""
+        import fitz
+        document = fitz.open()
+        document.new_page(width=842, height=1191)  # A3
+        content = document.tobytes()
+
+        def batch_annotate_images(requests):
+            # Visionは送信した画像の画素座標で結果を返すため、画像の右下の座標の単語を返す
+            pix = fitz.Pixmap(requests[0].image.content)
+            return vision.BatchAnnotateImagesResponse(responses=[vision.AnnotateImageResponse(full_text_annotation={
+                "text": "A3",
+                "pages": [{"width": pix.width, "height": pix.height, "blocks": [{"paragraphs": [{"words": [{
+                    "bounding_box": {"vertices": [{"x": pix.width, "y": pix.height}]}
+                }]}]}]}]
+            })])
+
+        mock_client = MagicMock()
+        mock_client.batch_annotate_images.side_effect = batch_annotate_images
+        mock_get_client.return_value = mock_client
+
+        result = extract_text_batch([(content, "a3.pdf")])
+
+        page = result[0][0].full_text_annotation.pages[0]
+        vertex = page.blocks[0].paragraphs[0].words[0].bounding_box.vertices[0]
+        # 150DPIで変換した画像の大きさ (verification/pdf_bbox_visualizer.py と同じ変換)
+        with fitz.open(stream=content, filetype="pdf") as pdf_document:
+            pix = pdf_document[0].get_pixmap(matrix=fitz.Matrix(150 / 72, 150 / 72))
+            expected = (pix.width, pix.height)
+        self.assertGreater(max(expected), 2000)
+        self.assertEqual((page.width, page.height), expected)
+        self.assertEqual((vertex.x, vertex.y), expected)
+
+    def test_render_pdf_pages_concurrently(self):
+        """複数のスレッドから同時にPDFを変換しても、PyMuPDFでの変換は1つずつ行われることをテスト"""
+        import fitz
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        contents = []
+        for text in ("invoice A", "invoice B"):
+            document = fitz.open()
+            document.new_page().insert_text((72, 72), text)
+            contents.append(document.tobytes())
+        expected = [_render_pdf_pages(content, "a.pdf") for content in contents]
+
+        active = 0
+        max_active = 0
+        counter_lock = threading.Lock()
+        original_open = fitz.open
+
+        def tracking_open(*args, **kwargs):
+            nonlocal active, max_active
+            with counter_lock:
+                active += 1
+                max_active = max(max_active, active)
+            # 他のスレッドが変換を始められる時間を作る
+            time.sleep(0.05)
+            document = original_open(*args, **kwargs)
+            with counter_lock:
+                active -= 1
+            return document
+
+        with patch.object(fitz, 'open', side_effect=tracking_open), ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(lambda content: _render_pdf_pages(content, "a.pdf"), contents * 2))
+
+        self.assertEqual(results, expected * 2)
+        self.assertEqual(max_active, 1)
+
+    def test_render_pdf_pages_empties_mupdf_store(self):
+        """PDFの変換後に、変換のロック内でMuPDFのストアが空にされることをテスト"""
+        import fitz
+        document = fitz.open()
+        document.new_page()
+        content = document.tobytes()
+
+        lock_held = []
+        with patch.object(fitz.TOOLS, 'store_shrink', side_effect=lambda percent: lock_held.append(_pdf_render_lock.locked())) as mock_store_shrink:
+            _render_pdf_pages(content, "a.pdf")
+
+        mock_store_shrink.assert_called_once_with(100)
+        # 他のスレッドの変換中にストアを空にしないよう、変換のロック内で呼ばれる
+        self.assertEqual(lock_held, [True])
+
+if __name__ == '__main__':
+    unittest.main()
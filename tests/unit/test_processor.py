@@ -6,6 +6,8 @@ from google.cloud import vision
 from src.processor import (
     vertices_to_bbox,
     bbox_overlap,
+    build_word_boxes,
+    find_overlapping_word_indices,
     sort_words_naturally,
     normalize_value,
     find_matching_word_sequence,
@@ -113,6 +115,29 @@ class TestProcessor(unittest.TestCase):
         self.assertFalse(bbox_overlap(None, bbox1))
         self.assertFalse(bbox_overlap(None, None))
 
+    def test_find_overlapping_words_matches_bbox_overlap(self):
+        """事前に計算したbboxでの重なり判定がbbox_overlapの判定と一致し、読み順で返されることをテスト"""
+        words = [
+            self.create_mock_word("D", 100, 100, 10, 10),
+            self.create_mock_word("B", 40, 10, 20, 20),
+            self.create_mock_word("C", 10, 60, 20, 20),
+            self.create_mock_word("A", 10, 10, 20, 20)
+        ]
+        word_without_bbox = MagicMock(bounding_box=None)
+        word_boxes = build_word_boxes(words + [word_without_bbox])
+
+        for llm_bbox in [{'x': 0, 'y': 0, 'width': 35, 'height': 35},
+                         {'x': 30, 'y': 30, 'width': 10, 'height': 30},
+                         {'x': 60.5, 'y': 0, 'width': 5, 'height': 100},
+                         {'x': 0, 'y': 0, 'width': 200, 'height': 200}]:
+            expected = [word for word in sort_words_naturally(words)
+                        if bbox_overlap(llm_bbox, vertices_to_bbox([{'x': v.x, 'y': v.y} for v in word.bounding_box.vertices]))]
+            indices = find_overlapping_word_indices(llm_bbox, word_boxes)
+            self.assertEqual([word_boxes.words[k] for k in indices], expected)
+            self.assertEqual([word_boxes.texts[k] for k in indices], ["".join(s.text for s in word.symbols) for word in expected])
+
+        self.assertEqual(find_overlapping_word_indices({'x': 0, 'y': 0, 'width': 10, 'height': 10}, build_word_boxes([])), [])
+
     def test_sort_words_naturally_valid_words(self):
         """OCR単語の自然順ソートのテスト"""
         words = [
@@ -213,6 +238,26 @@ class TestProcessor(unittest.TestCase):
         combined_text = "".join([symbol.text for word in result for symbol in word.symbols])
         self.assertEqual(combined_text, "10,000")
 
+    def test_find_matching_word_sequence_prefers_shortest_sequence(self):
+        """一致するシーケンスが複数ある場合に、最も短く先頭に近いシーケンスが返されることをテスト"""
+        words = [
+            self.create_mock_word("請求", 10, 10, 40, 20),
+            self.create_mock_word("株式", 60, 10, 40, 20),
+            self.create_mock_word("会社", 110, 10, 40, 20),
+            self.create_mock_word("株式会社", 10, 40, 80, 20),
+            self.create_mock_word("1,000", 10, 70, 50, 20),
+            self.create_mock_word("1000", 70, 70, 40, 20)
+        ]
+
+        result = find_matching_word_sequence("株式会社", words, "text")
+        self.assertEqual(result, [words[3]])
+
+        result = find_matching_word_sequence("求株", words, "text")
+        self.assertEqual(result, [words[0], words[1]])
+
+        result = find_matching_word_sequence("1000", words, "number")
+        self.assertEqual(result, [words[4]])
+
     def test_find_matching_word_sequence_no_match(self):
         """一致しない場合のテスト"""
         words = [
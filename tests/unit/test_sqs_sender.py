@@ -0,0 +1,96 @@
+import unittest
+import json
+from unittest.mock import patch, MagicMock
+from src.sqs_sender import send_batch_to_queue, _build_batch_entries, SQS_BATCH_MAX_ENTRIES
+
+
+class TestSqsSender(unittest.TestCase):
+
+    def test_build_batch_entries_splits_by_entry_count(self):
+        """10件ごとにバッチが分割されることをテスト"""
+        messages = [{"clipping_request_id": f"req-{i}", "clips": []} for i in range(23)]
+
+        batches = _build_batch_entries(messages)
+
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 3])
+        self.assertEqual(batches[2][0]["Id"], "20")
+        self.assertEqual(json.loads(batches[0][0]["MessageBody"]), messages[0])
+
+    def test_build_batch_entries_splits_by_payload_size(self):
+        """合計サイズが上限を超える場合にバッチが分割されることをテスト"""
+        large_value = "x" * (100 * 1024)
+        messages = [{"clipping_request_id": f"req-{i}", "data": large_value} for i in range(3)]
+
+        batches = _build_batch_entries(messages)
+
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+
+    @patch('src.sqs_sender.get_sqs_client')
+    def test_send_batch_to_queue_returns_ids_in_order(self, mock_get_client):
+        """メッセージIDが入力と同じ順序で返されることをテスト"""
+        mock_client = MagicMock()
+        mock_client.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            "Successful": [{"Id": e["Id"], "MessageId": f"id-{e['Id']}"} for e in reversed(Entries)]
+        }
+        mock_get_client.return_value = mock_client
+        messages = [{"clipping_request_id": f"req-{i}"} for i in range(SQS_BATCH_MAX_ENTRIES + 2)]
+
+        result = send_batch_to_queue(messages)
+
+        self.assertEqual(result, [f"id-{i}" for i in range(len(messages))])
+        self.assertEqual(mock_client.send_message_batch.call_count, 2)
+
+    @patch('src.sqs_sender.get_sqs_client')
+    def test_send_batch_to_queue_resends_failed_entries(self, mock_get_client):
+        """バッチ内で送信に失敗したエントリが個別に再送されることをテスト"""
+        mock_client = MagicMock()
+        mock_client.send_message_batch.return_value = {
+            "Successful": [{"Id": "0", "MessageId": "id-0"}],
+            "Failed": [{"Id": "1", "Code": "InternalError", "Message": "error", "SenderFault": False}]
+        }
+        mock_client.send_message.return_value = {"MessageId": "id-1"}
+        mock_get_client.return_value = mock_client
+
+        result = send_batch_to_queue([{"clipping_request_id": "req-0"}, {"clipping_request_id": "req-1"}])
+
+        self.assertEqual(result, ["id-0", "id-1"])
+        mock_client.send_message.assert_called_once()
+        self.assertEqual(json.loads(mock_client.send_message.call_args.kwargs["MessageBody"]), {"clipping_request_id": "req-1"})
+
+    @patch('src.sqs_sender.get_sqs_client')
+    def test_send_batch_to_queue_returns_none_for_unsent_entries(self, mock_get_client):
+        """再送できない、または再送にも失敗したエントリのメッセージIDがNoneで返されることをテスト"""
+        mock_client = MagicMock()
+        mock_client.send_message_batch.return_value = {
+            "Successful": [],
+            "Failed": [{"Id": "0", "Code": "InvalidMessageContents", "Message": "error", "SenderFault": True},
+                       {"Id": "1", "Code": "InternalError", "Message": "error", "SenderFault": False}]
+        }
+        mock_client.send_message.side_effect = Exception("SQS Error")
+        mock_get_client.return_value = mock_client
+
+        result = send_batch_to_queue([{"clipping_request_id": "req-0"}, {"clipping_request_id": "req-1"}])
+
+        self.assertEqual(result, [None, None])
+        # SenderFaultのエントリは再送しない
+        mock_client.send_message.assert_called_once()
+
+    @patch('src.sqs_sender.get_sqs_client')
+    def test_send_batch_to_queue_resends_entries_of_failed_batch(self, mock_get_client):
+        """バッチの送信自体が失敗した場合に、送信済みのバッチのIDを保ったまま個別に再送されることをテスト"""
+        mock_client = MagicMock()
+        mock_client.send_message_batch.side_effect = [
+            {"Successful": [{"Id": str(i), "MessageId": f"id-{i}"} for i in range(SQS_BATCH_MAX_ENTRIES)]},
+            Exception("SQS Error")
+        ]
+        mock_client.send_message.side_effect = [{"MessageId": "resent"}, Exception("SQS Error")]
+        mock_get_client.return_value = mock_client
+        messages = [{"clipping_request_id": f"req-{i}"} for i in range(SQS_BATCH_MAX_ENTRIES + 2)]
+
+        result = send_batch_to_queue(messages)
+
+        self.assertEqual(result, [f"id-{i}" for i in range(SQS_BATCH_MAX_ENTRIES)] + ["resent", None])
+
+
+if __name__ == '__main__':
+    unittest.main()